@@ -0,0 +1,54 @@
+# Compares two result files written by benchmarks.run, e.g.
+#
+#   python -m benchmarks.compare before.json after.json
+import argparse
+import json
+import sys
+
+# Slowdowns beyond this ratio are flagged as regressions
+REGRESSION_THRESHOLD = 1.1
+
+
+def _load(filename):
+    with open(filename, "r") as myfile:
+        report = json.load(myfile)
+    return report, {result["name"]: result for result in report["results"]}
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        prog="benchmarks.compare", description="Compare two benchmark runs."
+    )
+    arg_parser.add_argument("before", metavar="BEFORE.json")
+    arg_parser.add_argument("after", metavar="AFTER.json")
+    arg_parser.add_argument(
+        "--threshold",
+        default=REGRESSION_THRESHOLD,
+        type=float,
+        help=f"ratio flagged as a regression (default: {REGRESSION_THRESHOLD})",
+    )
+    args = arg_parser.parse_args(argv)
+
+    before_report, before = _load(args.before)
+    after_report, after = _load(args.after)
+    print(f"before: {before_report.get('commit')}  after: {after_report.get('commit')}")
+
+    regressions = 0
+    for name in before:
+        if name not in after:
+            continue
+        ratio = after[name]["min"] / before[name]["min"]
+        flag = ""
+        if ratio > args.threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(
+            f"{name:24} {before[name]['min'] * 1000:10.2f} ms "
+            f"-> {after[name]['min'] * 1000:10.2f} ms  x{ratio:.2f}{flag}"
+        )
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
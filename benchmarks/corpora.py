@@ -0,0 +1,113 @@
+# Reproducible synthetic inputs for the benchmarks. Everything is derived
+# from a seeded generator, so the same corpus is produced on every run.
+import random
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from xml.sax.saxutils import escape
+
+SEED = 1337
+
+FEED_SIZES = {"small": 20, "medium": 500, "huge": 5000}
+
+WORDS = (
+    "python rust vim nix linux kernel release security patch compiler async "
+    "database postgres sqlite network protocol http browser terminal editor "
+    "startup funding open source license hardware chip memory cache latency "
+    "benchmark performance parser regex filter stream feed story news update"
+).split()
+
+
+def _words(rng, count):
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+
+def _html_paragraphs(rng, paragraphs):
+    return "".join(
+        f"<p>{_words(rng, 30)} <b>{_words(rng, 3)}</b> "
+        f'<a href="https://example.com/{rng.randrange(10**6)}">link</a> '
+        f"#{rng.choice(WORDS)} @{rng.choice(WORDS)}</p>"
+        for _ in range(paragraphs)
+    )
+
+
+def _timestamps(rng, count):
+    # Spread over the last 60 days so every entry passes the date cutoff
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    return [now - timedelta(minutes=rng.randrange(60 * 24 * 60)) for _ in range(count)]
+
+
+def rss_feed(size):
+    rng = random.Random(f"{SEED}-rss-{size}")
+    items = []
+    for idx, timestamp in enumerate(_timestamps(rng, FEED_SIZES[size])):
+        items.append(
+            "<item>"
+            f"<title>{_words(rng, 8)}</title>"
+            f"<link>https://example.com/story/{idx}?utm_source=rss</link>"
+            f"<guid>https://example.com/story/{idx}</guid>"
+            f"<description>{escape(_html_paragraphs(rng, 3))}</description>"
+            f"<pubDate>{format_datetime(timestamp)}</pubDate>"
+            "</item>"
+        )
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<rss version="2.0"><channel><title>Benchmark</title><ttl>60</ttl>'
+        + "".join(items)
+        + "</channel></rss>"
+    ).encode("utf-8")
+
+
+def atom_feed(size):
+    rng = random.Random(f"{SEED}-atom-{size}")
+    entries = []
+    for idx, timestamp in enumerate(_timestamps(rng, FEED_SIZES[size])):
+        entries.append(
+            "<entry>"
+            f"<title>{_words(rng, 8)}</title>"
+            f'<link rel="alternate" href="https://example.org/entry/{idx}"/>'
+            f"<id>urn:entry:{idx}</id>"
+            f"<published>{timestamp.isoformat()}</published>"
+            f"<description>{escape(_html_paragraphs(rng, 3))}</description>"
+            "</entry>"
+        )
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<feed xmlns="http://www.w3.org/2005/Atom"><title>Benchmark</title>'
+        + "".join(entries)
+        + "</feed>"
+    ).encode("utf-8")
+
+
+def tweets_html(count=200):
+    rng = random.Random(f"{SEED}-tweets-{count}")
+    tweets = []
+    for idx, timestamp in enumerate(_timestamps(rng, count)):
+        tweets.append(
+            '<div class="stream-item-header">'
+            f'<strong class="fullname">{_words(rng, 2)}</strong>'
+            f'<span class="username">@<b>{rng.choice(WORDS)}{idx}</b></span>'
+            f'<a class="tweet-timestamp" href="/user/status/{idx}">'
+            f'<span class="_timestamp" data-time="{int(timestamp.timestamp())}">'
+            "</span></a></div>"
+            f'<p class="tweet-text">{_words(rng, 25)}…'
+            f"https://t.co/{rng.randrange(10**6)}</p>"
+        )
+    return "<html><body>" + "".join(tweets) + "</body></html>"
+
+
+def filters(count=200):
+    rng = random.Random(f"{SEED}-filters-{count}")
+    output = []
+    for idx in range(count):
+        kind = idx % 4
+        if kind == 0:
+            output.append(rng.choice(WORDS) + " " + rng.choice(WORDS))
+        elif kind == 1:
+            output.append(f"{rng.choice(WORDS)} && {rng.choice(WORDS)}")
+        elif kind == 2:
+            output.append(
+                f"({rng.choice(WORDS)} || {rng.choice(WORDS)}) && !{rng.choice(WORDS)}"
+            )
+        else:
+            output.append(f"'{rng.choice(WORDS)}s?' || \\b{rng.choice(WORDS)}\\b")
+    return output
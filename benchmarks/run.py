@@ -0,0 +1,292 @@
+# Benchmarks for krill's hot paths. Results are written as json so that runs
+# from different commits can be compared with benchmarks.compare:
+#
+#   python -m benchmarks.run -o before.json
+#   git checkout other-branch
+#   python -m benchmarks.run -o after.json
+#   python -m benchmarks.compare before.json after.json
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from argparse import Namespace
+from datetime import datetime, timezone
+
+from krill.feed.parser import StreamParser, TextExcerpter
+from krill.krill import EXCERPT_LENGTH, TERMINAL, Application
+from krill.output import highlight, merge_spans
+from krill.sources.lexer import filter_lex
+from krill.sources.parser import TextBatch, TokenParser
+
+from . import corpora
+
+DEFAULT_REPEAT = 5
+
+BENCHMARKS = dict()
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return register
+
+
+async def _feed_items(data, url):
+    # Read every field so lazily converted text is included in the cost
+    count = 0
+    async for item in StreamParser.get_feed_items(data, url):
+        item.text
+        count += 1
+    return count
+
+
+def _feed_benchmark(kind, size):
+    data = getattr(corpora, f"{kind}_feed")(size)
+    url = f"https://example.com/{kind}.xml"
+
+    async def run():
+        return await _feed_items(data, url)
+
+    return run
+
+
+for _kind in ("rss", "atom"):
+    for _size in corpora.FEED_SIZES:
+        BENCHMARKS[f"parse_{_kind}_{_size}"] = (
+            lambda kind=_kind, size=_size: _feed_benchmark(kind, size)
+        )
+
+
+@benchmark("parse_tweets")
+def _():
+    html = corpora.tweets_html()
+
+    async def run():
+        return len([item async for item in StreamParser.get_tweets(html)])
+
+    return run
+
+
+@benchmark("build_filters")
+def _():
+    filters = corpora.filters()
+
+    async def run():
+        for filter_string in filters:
+            TokenParser(filter_lex(filter_string)).build()
+        return len(filters)
+
+    return run
+
+
+async def _sample_items(count=500):
+    items = []
+    async for item in StreamParser.get_feed_items(
+        corpora.rss_feed("medium"), "https://example.com/rss.xml"
+    ):
+        item.text
+        items.append(item)
+        if len(items) >= count:
+            break
+    return items
+
+
+@benchmark("evaluate_filters")
+def _():
+    funcs = [TokenParser(filter_lex(f)).build() for f in corpora.filters()]
+    items = asyncio.run(_sample_items())
+
+    async def run():
+        matched = 0
+        for item in items:
+            for func in funcs:
+                if func(item.title)[0] or func(item.text)[0] or func(item.link)[0]:
+                    matched += 1
+                    break
+        return len(items)
+
+    return run
+
+
+@benchmark("evaluate_filters_batch")
+def _():
+    funcs = [TokenParser(filter_lex(f)).compile() for f in corpora.filters()]
+    items = asyncio.run(_sample_items())
+
+    async def run():
+        batches = [
+            TextBatch([getattr(item, name) for item in items])
+            for name in ("title", "text", "link")
+        ]
+        remaining = (1 << len(items)) - 1
+        for func in funcs:
+            for batch in batches:
+                remaining &= ~func.match_batch(batch, remaining)[0]
+            if not remaining:
+                break
+        return len(items)
+
+    return run
+
+
+def _matches(items):
+    # Match spans per field, as handed from the filter stage to rendering
+    funcs = [TokenParser(filter_lex(f)).build() for f in corpora.filters()]
+    output = []
+    for item in items:
+        spans = {"title": set(), "text": set(), "link": set()}
+        for func in funcs:
+            for name in spans:
+                result = func(getattr(item, name))
+                if result[0]:
+                    spans[name].update(result[1])
+        output.append(spans if any(spans.values()) else None)
+    return output
+
+
+@benchmark("excerpt")
+def _():
+    items = asyncio.run(_sample_items())
+    patterns = _matches(items)
+
+    async def run():
+        for item, item_patterns in zip(items, patterns):
+            await TextExcerpter.get_excerpt(
+                item.text,
+                EXCERPT_LENGTH // 4,
+                merge_spans(item_patterns and item_patterns["text"]),
+            )
+        return len(items)
+
+    return run
+
+
+@benchmark("highlight")
+def _():
+    items = asyncio.run(_sample_items())
+    patterns = _matches(items)
+
+    async def run():
+        for item, item_patterns in zip(items, patterns):
+            highlight(
+                item.text,
+                merge_spans(item_patterns and item_patterns["text"]),
+                TERMINAL.black_on_yellow,
+                decorations=Application._decorations(item.text),
+            )
+        return len(items)
+
+    return run
+
+
+def _application():
+    args = Namespace(
+        text_speed_ave="0",
+        verbose=False,
+        snapshot=False,
+        http2=False,
+        max_connections=1,
+        max_keepalive_connections=1,
+        domain_limit=None,
+    )
+    return Application(args)
+
+
+@benchmark("render_items")
+def _():
+    items = asyncio.run(_sample_items())
+    patterns = _matches(items)
+
+    async def run():
+        application = _application()
+        for item, item_patterns in zip(items, patterns):
+            await application._queue_item(item, item_patterns)
+        return len(items)
+
+    return run
+
+
+def measure(name, factory, repeat):
+    run = factory()
+    timings = []
+    with asyncio.Runner() as runner:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            count = runner.run(run())
+            timings.append(time.perf_counter() - start)
+
+    return {
+        "name": name,
+        "items": count,
+        "repeat": repeat,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+        "per_item": min(timings) / count if count else None,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        prog="benchmarks.run", description="Benchmark krill's hot paths."
+    )
+    arg_parser.add_argument(
+        "-o", "--output", help="file to write json results to", metavar="FILE"
+    )
+    arg_parser.add_argument(
+        "-r",
+        "--repeat",
+        default=DEFAULT_REPEAT,
+        type=int,
+        help=f"timed runs per benchmark (default: {DEFAULT_REPEAT})",
+    )
+    arg_parser.add_argument(
+        "names", nargs="*", help="benchmarks to run (default: all)", metavar="NAME"
+    )
+    args = arg_parser.parse_args(argv)
+
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        arg_parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results = []
+    for name in args.names or BENCHMARKS:
+        result = measure(name, BENCHMARKS[name], args.repeat)
+        results.append(result)
+        print(
+            f"{name:24} {result['min'] * 1000:10.2f} ms " f"({result['items']} items)",
+            file=sys.stderr,
+        )
+
+    report = {
+        "commit": _git_commit(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as myfile:
+            json.dump(report, myfile, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import json
+import os
+
+
+class ValidatorCache:
+    # Remembers the ETag and Last-Modified validators returned for each URL so
+    # that unchanged feeds can be answered with a cheap 304 Not Modified.
+    # Without a path the cache only lives as long as the process. Entries may
+    # carry a key, e.g. for the filters the feed was parsed with, and are
+    # only used while it stays the same.
+    def __init__(self, path=None):
+        self.path = path
+        self._entries = dict()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        if self.path is None:
+            return self
+        try:
+            with open(self.path, "r") as myfile:
+                entries = json.load(myfile)
+        except (OSError, ValueError):
+            entries = dict()
+
+        if isinstance(entries, dict):
+            self._entries = entries
+        return self
+
+    def headers(self, url, key=None):
+        entry = self._entries.get(url)
+        if not entry or entry.get("key") != key:
+            return dict()
+
+        headers = dict()
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def not_modified(self):
+        self.hits += 1
+
+    def update(self, url, headers, key=None):
+        self.misses += 1
+        entry = {
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+        }
+        if not any(entry.values()):
+            if self._entries.pop(url, None) is not None:
+                self._dirty = True
+            return
+        if key is not None:
+            entry["key"] = key
+
+        if self._entries.get(url) != entry:
+            self._entries[url] = entry
+            self._dirty = True
+
+    def save(self):
+        if self.path is None or not self._dirty:
+            return
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as myfile:
+            json.dump(self._entries, myfile)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
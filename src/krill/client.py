@@ -0,0 +1,78 @@
+import importlib.util
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import httpx
+
+MAX_CONNECTIONS = 10
+MAX_KEEPALIVE_CONNECTIONS = 5
+KEEPALIVE_EXPIRY = 30
+
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class ClientPool:
+    # Long-lived httpx clients keyed by domain so that successive requests to
+    # the same host can reuse kept-alive (or multiplexed HTTP/2) connections
+    def __init__(
+        self,
+        proxy=None,
+        http2=False,
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    ):
+        self.proxy = proxy
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._clients = dict()
+        self._requests = defaultdict(int)
+        self._connections = defaultdict(int)
+
+    def client(self, domain):
+        if domain not in self._clients:
+            self._clients[domain] = httpx.AsyncClient(
+                follow_redirects=True,
+                proxy=self.proxy,
+                http2=self.http2,
+                limits=self.limits,
+            )
+        return self._clients[domain]
+
+    async def get(self, url, **kwargs):
+        domain = urlparse(url).netloc
+
+        async def trace(event_name, info):
+            # Only fired when the pool has to open a brand new connection
+            if event_name == "connection.connect_tcp.complete":
+                self._connections[domain] += 1
+
+        self._requests[domain] += 1
+        return await self.client(domain).get(url, extensions={"trace": trace}, **kwargs)
+
+    def stats(self):
+        output = dict()
+        for domain, requests in self._requests.items():
+            connections = self._connections[domain]
+            output[domain] = {
+                "requests": requests,
+                "connections": connections,
+                "reused": max(requests - connections, 0),
+            }
+        return output
+
+    def reuse_ratio(self):
+        requests = sum(self._requests.values())
+        if not requests:
+            return 0.0
+        connections = sum(self._connections.values())
+        return max(requests - connections, 0) / requests
+
+    async def aclose(self):
+        clients, self._clients = self._clients, dict()
+        for client in clients.values():
+            await client.aclose()
@@ -0,0 +1,136 @@
+import asyncio
+import json
+import os
+import stat
+
+from .sources.parser import compile_filter
+
+SOCKET_NAME = "krill.sock"
+MAX_REQUEST_SIZE = 1 << 16
+
+
+class DaemonRunning(Exception):
+    pass
+
+
+def matches(re_funcs, *values):
+    # Same rule as the stream filters: any filter matching any field
+    if not re_funcs:
+        return True
+    return any(
+        value is not None and re_func(value)[0]
+        for re_func in re_funcs
+        for value in values
+    )
+
+
+class QueryServer:
+    # Answers queries from the item store over a Unix socket. A client sends
+    # one json request line, e.g.
+    #
+    #     {"filters": ["python"], "since": 1700000000, "limit": 20}
+    #
+    # and receives the matching items as newline-delimited json, newest
+    # first, after which the connection is closed. A bad request is answered
+    # with a single {"error": ...} line instead.
+    def __init__(self, store, path):
+        self.store = store
+        self.path = path
+        # Compiled filters by filter string, so repeated queries skip the
+        # lexer and parser
+        self._filters = dict()
+        self._server = None
+
+    async def start(self):
+        try:
+            if stat.S_ISSOCK(os.stat(self.path).st_mode):
+                await self._remove_stale_socket()
+        except FileNotFoundError:
+            pass
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._server = await asyncio.start_unix_server(
+            self._handle, path=self.path, limit=MAX_REQUEST_SIZE
+        )
+        return self
+
+    async def _remove_stale_socket(self):
+        try:
+            _, writer = await asyncio.open_unix_connection(self.path)
+        except ConnectionRefusedError:
+            # Left behind by a daemon that did not shut down cleanly
+            os.unlink(self.path)
+            return
+
+        writer.close()
+        await writer.wait_closed()
+        raise DaemonRunning(f"A daemon is already listening on '{self.path}'")
+
+    def _filter(self, filter_string):
+        if filter_string not in self._filters:
+            self._filters[filter_string] = compile_filter(filter_string)
+        return self._filters[filter_string]
+
+    def query(self, request):
+        if not isinstance(request, dict):
+            raise ValueError("Request must be a json object")
+
+        re_funcs = [
+            self._filter(filter_string)
+            for filter_string in request.get("filters") or ()
+        ]
+        limit = request.get("limit")
+
+        lines = []
+        for title, text, link, record in self.store.items(request.get("since")):
+            if limit is not None and len(lines) >= limit:
+                break
+            if matches(re_funcs, title, text, link):
+                lines.append(record)
+        return lines
+
+    async def _handle(self, reader, writer):
+        try:
+            if not (request := await reader.readline()):
+                # Closed without a request, e.g. another daemon checking
+                # whether this one is alive
+                return
+            try:
+                lines = self.query(json.loads(request))
+            except Exception as error:
+                lines = [json.dumps({"error": f"{error.__class__.__name__}: {error}"})]
+
+            writer.write("".join(f"{line}\n" for line in lines).encode("utf-8"))
+            await writer.drain()
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+    async def close(self):
+        if self._server is None:
+            return
+        self._server.close()
+        await self._server.wait_closed()
+        self._server = None
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+async def query(path, request):
+    # Sends one request to a running daemon and returns its raw response
+    reader, writer = await asyncio.open_unix_connection(path)
+    try:
+        writer.write((json.dumps(request) + "\n").encode("utf-8"))
+        await writer.drain()
+        return (await reader.read()).decode("utf-8")
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+def error_response(response):
+    if response.startswith('{"error"'):
+        return json.loads(response)["error"]
+    return None
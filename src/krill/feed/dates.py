@@ -0,0 +1,45 @@
+from collections import Counter
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+
+from dateutil import parser as dt_parser
+
+DATE_CACHE_SIZE = 4096
+
+# Which parser handled each distinct date string
+DATE_PARSE_STATS = Counter()
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def _parse_date(date_str):
+    # ISO 8601 / RFC 3339 (Atom), e.g. 2024-01-02T03:04:05Z
+    if date_str[:1].isdigit():
+        try:
+            timestamp = datetime.fromisoformat(date_str)
+            DATE_PARSE_STATS["iso8601"] += 1
+            return timestamp
+        except ValueError:
+            pass
+
+    # RFC 822 / RFC 1123 (RSS), e.g. Tue, 02 Jan 2024 03:04:05 GMT
+    try:
+        timestamp = parsedate_to_datetime(date_str)
+        if timestamp.tzinfo is None and date_str.endswith("-0000"):
+            # Strictly "unknown zone", but in feeds it always means UTC
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        DATE_PARSE_STATS["rfc822"] += 1
+        return timestamp
+    except (TypeError, ValueError, IndexError):
+        pass
+
+    DATE_PARSE_STATS["fallback"] += 1
+    return dt_parser.parse(date_str)
+
+
+def parse_date(date_str):
+    return _parse_date(date_str.strip())
+
+
+def date_parse_stats():
+    return dict(DATE_PARSE_STATS, cached=_parse_date.cache_info().hits)
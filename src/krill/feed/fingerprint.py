@@ -0,0 +1,85 @@
+import hashlib
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+TRACKING_PARAM_PREFIXES = ("utm_",)
+TRACKING_PARAMS = {
+    "fbclid",
+    "gclid",
+    "dclid",
+    "igshid",
+    "mc_cid",
+    "mc_eid",
+    "ref",
+    "ref_src",
+    "_hsenc",
+    "_hsmi",
+}
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# Shorter titles ("Weekly thread", "Comments") are too generic to identify
+# a story on their own
+MIN_FINGERPRINT_WORDS = 4
+FINGERPRINT_TEXT_LENGTH = 200
+
+_non_word_regex = re.compile(r"[\W_]+")
+
+
+def canonical_link(link):
+    # Reduces the many spellings of the same URL (scheme, www., default port,
+    # trailing slash, fragment, tracking parameters) to one comparable form
+    if not link:
+        return None
+
+    try:
+        parts = urlsplit(link.strip())
+        port = parts.port
+    except ValueError:
+        return link
+
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if port and port != DEFAULT_PORTS.get(parts.scheme.lower()):
+        host = f"{host}:{port}"
+
+    query = sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS
+        and not key.lower().startswith(TRACKING_PARAM_PREFIXES)
+    )
+
+    output = host + parts.path.rstrip("/")
+    if query:
+        output += "?" + urlencode(query)
+    return output
+
+
+def _normalize(text):
+    return " ".join(_non_word_regex.sub(" ", text.lower()).split())
+
+
+def fingerprint(item):
+    # Hash of the normalised title (or the start of the text for title-less
+    # items such as tweets), used to spot one story arriving via several
+    # sources
+    if item.title:
+        content = _normalize(item.title)
+    elif item.text:
+        content = _normalize(item.text[:FINGERPRINT_TEXT_LENGTH])
+    else:
+        return None
+
+    if len(content.split()) < MIN_FINGERPRINT_WORDS:
+        return None
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=12).hexdigest()
+
+
+def dedup_keys(item):
+    keys = []
+    if link := canonical_link(item.link):
+        keys.append(f"link:{link}")
+    if content := fingerprint(item):
+        keys.append(f"fp:{content}")
+    return keys
@@ -1,13 +1,15 @@
+import asyncio
 import re
 import warnings
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from datetime import datetime
 from itertools import chain
 from urllib.parse import urlparse
 
 from bs4 import BeautifulSoup, MarkupResemblesLocatorWarning
-from dateutil import parser as dt_parser
+from lxml import etree
 
+from krill.feed.dates import parse_date
 from krill.utils import validate_timestamp
 
 warnings.filterwarnings("ignore", category=MarkupResemblesLocatorWarning)
@@ -15,6 +17,9 @@ warnings.filterwarnings("ignore", category=MarkupResemblesLocatorWarning)
 
 _link_regex = re.compile(r"(?<=\S)(https?://|pics?.(x|twitter).com)")
 
+FEED_CHUNK_SIZE = 64 * 1024
+FEED_ENTRY_TAGS = ("{*}entry", "{*}item")
+
 
 @dataclass
 class StreamItem:
@@ -23,10 +28,89 @@ class StreamItem:
     title: str
     text: str
     link: str
+    # RSS <guid> or Atom <id>, where the feed has one
+    guid: str = None
+
+
+def entry_id(source, guid, link):
+    # Identity of a feed entry, known as soon as the entry has been read and
+    # before any of its content is converted
+    return f"{source}\t{guid or link}"
+
+
+class LazyStreamItem(StreamItem):
+    # Feed item whose HTML description is only converted to text the first
+    # time the text is read, so items dropped as old or already seen never
+    # pay for a BeautifulSoup parse
+    def __init__(self, source, time, title, html, link, guid=None):
+        super().__init__(source, time, title, None, link, guid)
+        self._html = html
+
+    @property
+    def text(self):
+        if self._html is not None:
+            self._text = _fix_links(html_to_text(self._html))
+            self._html = None
+        return self._text
+
+    @text.setter
+    def text(self, value):
+        self._text = value
+        self._html = None
+
+
+class _Element:
+    # Wraps an lxml element with the subset of BeautifulSoup's Tag interface
+    # used by get_feed_items, so both parsers can share the extraction code
+    __slots__ = ("_element",)
+
+    def __init__(self, element):
+        self._element = element
+
+    def __getattr__(self, name):
+        # Like BeautifulSoup, entry.title finds the first descendant <title>
+        # regardless of its namespace prefix
+        for child in self._element.iterdescendants():
+            if isinstance(child.tag, str) and etree.QName(child).localname == name:
+                return _Element(child)
+        return None
+
+    @property
+    def text(self):
+        return "".join(self._element.itertext())
+
+    def __str__(self):
+        # Only the attributes are needed (e.g. Atom's <link href="..."/>);
+        # etree.tostring would also emit namespace declarations
+        attrs = "".join(
+            f' {etree.QName(key).localname}="{value}"'
+            for key, value in self._element.attrib.items()
+        )
+        return f"<{etree.QName(self._element).localname}{attrs}>{self.text}"
+
+
+def _chunks(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    for start in range(0, len(data), FEED_CHUNK_SIZE):
+        yield data[start : start + FEED_CHUNK_SIZE]
+
+
+def _fix_links(text):
+    return _link_regex.sub(r" \1", text)
 
 
 async def fix_html(text):
-    return _link_regex.sub(r" \1", text)
+    return _fix_links(text)
+
+
+def html_to_text(html):
+    # Hack to prevent Beautiful Soup from collapsing space-keeping tags
+    # until no whitespace remains at all
+    html = re.sub(r"<(br|p|li)", " \\g<0>", html, flags=re.IGNORECASE)
+    text = BeautifulSoup(html, "html.parser").get_text()
+    # Idea from http://stackoverflow.com/a/1546251
+    return " ".join(text.strip().split())
 
 
 async def extract_link(link):
@@ -37,12 +121,7 @@ async def extract_link(link):
 class StreamParser:
     @staticmethod
     async def _html_to_text(html):
-        # Hack to prevent Beautiful Soup from collapsing space-keeping tags
-        # until no whitespace remains at all
-        html = re.sub(r"<(br|p|li)", " \\g<0>", html, flags=re.IGNORECASE)
-        text = BeautifulSoup(html, "html.parser").get_text()
-        # Idea from http://stackoverflow.com/a/1546251
-        return " ".join(text.strip().split())
+        return html_to_text(html)
 
     @classmethod
     async def get_tweets(cls, html):
@@ -75,12 +154,52 @@ class StreamParser:
             )
 
     @classmethod
-    async def _parse_feed(cls, xml):
+    async def _iter_feed(cls, data):
+        # Emits entries as soon as their closing tag has been parsed and frees
+        # them once the consumer is done, so memory stays flat for big feeds
+        parser = etree.XMLPullParser(
+            events=("end",), tag=FEED_ENTRY_TAGS, resolve_entities=False
+        )
+
+        def entries():
+            for _, element in parser.read_events():
+                yield element
+
+        for chunk in _chunks(data):
+            parser.feed(chunk)
+            for element in entries():
+                yield _Element(element)
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+
+        parser.close()
+        for element in entries():
+            yield _Element(element)
+
+    @classmethod
+    async def _soup_feed(cls, xml):
         soup = BeautifulSoup(xml, "xml")
-        found = False
         for entry in chain(soup.find_all("entry"), soup.find_all("item")):
             yield entry
-            found = True
+
+    @classmethod
+    async def _parse_feed(cls, xml):
+        found = 0
+        try:
+            async for entry in cls._iter_feed(xml):
+                yield entry
+                found += 1
+        except etree.LxmlError:
+            # Malformed feed; let BeautifulSoup's lenient parser have a go at
+            # it, skipping whatever the streaming parser already produced
+            skip = found
+            async for entry in cls._soup_feed(xml):
+                if skip:
+                    skip -= 1
+                    continue
+                yield entry
+                found += 1
 
         if not found:
             raise Exception("Failed to find entries")
@@ -96,13 +215,24 @@ class StreamParser:
         else:
             return None
 
-        timestamp = dt_parser.parse(date_str)
+        timestamp = parse_date(date_str)
         return timestamp
 
     @classmethod
-    async def get_feed_items(cls, xml, url):
+    async def get_feed_items(cls, xml, url, seen=None):
+        # Entries for which seen(entry_id(...)) is true are dropped before
+        # their date, title or description are looked at
         feed_title = urlparse(url).netloc
         async for entry in cls._parse_feed(xml):
+            guid = entry.guid or entry.id
+            guid = (guid and guid.text.strip()) or None
+
+            link = (entry.link and entry.link.text.strip()) or str(entry.link)
+            link = await extract_link(link)
+
+            if seen is not None and seen(entry_id(feed_title, guid, link)):
+                continue
+
             timestamp = cls._feed_item_date(entry)
 
             if not validate_timestamp(timestamp):
@@ -113,21 +243,40 @@ class StreamParser:
             description = (
                 entry.description and entry.description.text.strip()
             ) or entry.text.strip()
-            text = await cls._html_to_text(description)
 
-            link = (entry.link and entry.link.text.strip()) or str(entry.link)
-            link = await extract_link(link)
-
-            # Some feeds put the text in the title element
-            if text is None and title is not None:
-                text = title
-                title = None
+            item = LazyStreamItem(feed_title, timestamp, title, description, link, guid)
 
             # At least one element must contain text for the item to be useful
-            if title or text or link:
-                yield StreamItem(
-                    feed_title, timestamp, title, await fix_html(text), link
-                )
+            if title or link or item.text:
+                yield item
+
+    @classmethod
+    async def get_items(cls, data, url, seen=None):
+        if "//x.com/" in url:
+            async for item in cls.get_tweets(data):
+                yield item
+        else:
+            async for item in cls.get_feed_items(data, url, seen):
+                yield item
+
+
+async def _collect_items(data, url, seen=None):
+    return [
+        tuple(getattr(item, field.name) for field in fields(StreamItem))
+        async for item in StreamParser.get_items(data, url, seen)
+    ]
+
+
+# Entry point for parse worker processes. Items are returned as plain tuples
+# to keep the pickled batch small; see unpack_items. Entries whose id is in
+# known are skipped without being converted to text.
+def parse_items(data, url, known=None):
+    seen = known.__contains__ if known else None
+    return asyncio.run(_collect_items(data, url, seen))
+
+
+def unpack_items(batch):
+    return [StreamItem(*values) for values in batch]
 
 
 class TextExcerpter:
@@ -142,43 +291,48 @@ class TextExcerpter:
         return re.sub(r"\s*\S*$", "", text, 1)
 
     @staticmethod
-    async def _get_max_pattern_span(text, patterns):
-        min_start, max_end = None, None
-        if patterns is not None:
-            for pattern in patterns:
-                if isinstance(pattern, str):
-                    regex = re.compile(pattern)
-                else:
-                    regex = pattern
-
-                if match := regex.search(text):
-                    start, end = match.span()
-                    if min_start is None:
-                        min_start = start
-                    else:
-                        min_start = min(min_start, start)
-                    if max_end is None:
-                        max_end = end
-                    else:
-                        max_end = max(max_end, end)
-
-        return min_start, max_end
-
-    # Returns a portion of text at most max_length in length
-    # and containing the first match of pattern, if specified
+    async def _get_max_pattern_span(spans, max_length):
+        # The first match and as many of the following ones as fit
+        if not spans:
+            return None, None
+
+        start, end = spans[0]
+        for span_start, span_end in spans[1:]:
+            if span_end - start > max_length:
+                break
+            end = max(end, span_end)
+        return start, end
+
+    @staticmethod
+    def _shift_spans(spans, start, end):
+        return [
+            (max(span_start, start) - start, min(span_end, end) - start)
+            for span_start, span_end in spans
+            if span_start < end and span_end > start
+        ]
+
+    # Returns a portion of text at most max_length in length and containing
+    # the first of the given match spans, if any. The spans must be sorted
+    # and not overlap; those inside the excerpt are returned relative to it.
     @classmethod
-    async def get_excerpt(cls, text, max_length, patterns=None):
+    async def get_excerpt(cls, text, max_length, spans=None):
+        spans = spans or []
         if len(text) <= max_length:
-            return text, False, False
+            return text, False, False, spans
 
-        start, end = await cls._get_max_pattern_span(text, patterns)
+        start, end = await cls._get_max_pattern_span(spans, max_length)
         if start is None and end is None:
-            return await cls._clip_right(text[:max_length]), False, True
+            return await cls._clip_right(text[:max_length]), False, True, []
         else:
             remaining_length = max_length - (end - start)
             if remaining_length <= 0:
                 # Matches are never clipped
-                return text[start:end], False, False
+                return (
+                    text[start:end],
+                    False,
+                    False,
+                    cls._shift_spans(spans, start, end),
+                )
 
             excerpt_start = max(start - (remaining_length // 2), 0)
             excerpt_end = min(
@@ -187,9 +341,19 @@ class TextExcerpter:
             # Adjust start of excerpt in case the string after the match was too short
             excerpt_start = max(excerpt_end - max_length, 0)
             excerpt = text[excerpt_start:excerpt_end]
+
+            # Track where the clipped excerpt sits so the spans can follow it
+            offset = excerpt_start
             if excerpt_start > 0:
-                excerpt = await cls._clip_left(excerpt)
+                clipped = await cls._clip_left(excerpt)
+                offset += len(excerpt) - len(clipped)
+                excerpt = clipped
             if excerpt_end < len(text):
                 excerpt = await cls._clip_right(excerpt)
 
-            return excerpt, excerpt_start > 0, excerpt_end < len(text)
+            return (
+                excerpt,
+                excerpt_start > 0,
+                excerpt_end < len(text),
+                cls._shift_spans(spans, offset, offset + len(excerpt)),
+            )
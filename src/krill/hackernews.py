@@ -0,0 +1,285 @@
+import asyncio
+import json
+import os
+import random
+import time
+from collections import deque
+from datetime import datetime
+
+from .feed.parser import StreamItem
+from .utils import validate_timestamp
+
+HN_API_URL = "https://hacker-news.firebaseio.com/v0"
+MIN_NUMBER_OF_HN_STORIES = 1
+MAX_NUMBER_OF_HN_STORIES = 5
+HN_CONCURRENCY = 10
+HN_ITEM_TTL = 5 * 60
+# Upper bound on the new item ids (stories, comments, polls...) fetched in a
+# single incremental poll; older ones are skipped after a long pause
+HN_MAX_NEW_ITEMS = 1000
+REQUESTS_TIMEOUT = 10
+
+rand = random.SystemRandom()
+
+
+class ItemCache:
+    # Recently fetched item payloads, optionally persisted to a json file so
+    # a quick restart does not fetch them all again
+    def __init__(self, path=None, ttl=HN_ITEM_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._items = dict()
+        self._dirty = False
+
+    def load(self):
+        if self.path is None:
+            return self
+        try:
+            with open(self.path, "r") as myfile:
+                self._items = {
+                    int(item_id): (fetched_at, payload)
+                    for item_id, (fetched_at, payload) in json.load(myfile).items()
+                }
+        except (OSError, ValueError, TypeError, AttributeError):
+            self._items = dict()
+        return self
+
+    def get(self, item_id):
+        if entry := self._items.get(item_id):
+            fetched_at, payload = entry
+            if time.time() - fetched_at < self.ttl:
+                return payload
+            del self._items[item_id]
+            self._dirty = True
+        return None
+
+    def put(self, item_id, payload):
+        self._items[item_id] = (time.time(), payload)
+        self._dirty = True
+
+    def save(self):
+        cutoff = time.time() - self.ttl
+        count = len(self._items)
+        self._items = {
+            item_id: entry
+            for item_id, entry in self._items.items()
+            if entry[0] >= cutoff
+        }
+        if len(self._items) != count:
+            self._dirty = True
+        if self.path is None or not self._dirty:
+            return
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as myfile:
+            json.dump(self._items, myfile)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+
+class HackerNewsSource:
+    def __init__(
+        self,
+        clients,
+        cache=None,
+        stories=None,
+        concurrency=HN_CONCURRENCY,
+        base_url=HN_API_URL,
+        timeout=REQUESTS_TIMEOUT,
+        incremental=False,
+        cursor_path=None,
+        on_error=None,
+    ):
+        self.clients = clients
+        self.cache = cache if cache is not None else ItemCache()
+        # Number of stories per cycle, or None for a small random sample
+        self.stories_per_cycle = stories
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._on_error = on_error
+        # In incremental mode only items newer than the cursor, the highest
+        # item id seen by the previous poll, are fetched
+        self.incremental = incremental
+        self.cursor_path = cursor_path
+        self.cursor = None
+
+    def load(self):
+        if self.cursor_path is None:
+            return self
+        try:
+            with open(self.cursor_path, "r") as myfile:
+                self.cursor = int(json.load(myfile)["maxitem"])
+        except (OSError, ValueError, KeyError, TypeError):
+            self.cursor = None
+        return self
+
+    def save(self):
+        self.cache.save()
+        if self.cursor_path is None or self.cursor is None:
+            return
+
+        os.makedirs(os.path.dirname(self.cursor_path) or ".", exist_ok=True)
+        tmp_path = f"{self.cursor_path}.tmp"
+        with open(tmp_path, "w") as myfile:
+            json.dump({"maxitem": self.cursor}, myfile)
+        os.replace(tmp_path, self.cursor_path)
+
+    async def _error(self, error):
+        if self._on_error is not None:
+            await self._on_error(error)
+
+    async def _get_json(self, path):
+        async with self._semaphore:
+            resp = await self.clients.get(
+                f"{self.base_url}/{path}", timeout=self.timeout
+            )
+        resp.raise_for_status()
+        return resp.json()
+
+    async def _story_ids(self, name):
+        try:
+            return await self._get_json(f"{name}.json") or []
+        except Exception as e:
+            await self._error(str(e))
+            return []
+
+    async def story_ids(self):
+        top, new = await asyncio.gather(
+            self._story_ids("topstories"), self._story_ids("newstories")
+        )
+        return list(set(top) | set(new))
+
+    async def max_item(self):
+        try:
+            return int(await self._get_json("maxitem.json"))
+        except Exception as e:
+            await self._error(str(e))
+            return None
+
+    async def item(self, item_id, cache=True):
+        if cache and (payload := self.cache.get(item_id)) is not None:
+            return payload
+
+        try:
+            payload = await self._get_json(f"item/{item_id}.json")
+        except Exception as e:
+            await self._item_error(item_id, e)
+            return None
+
+        if payload and cache:
+            self.cache.put(item_id, payload)
+        return payload
+
+    async def _item_error(self, item_id, error):
+        await self._error(f"Error getting HackerNews story {item_id}: {error}")
+
+    def _number_of_stories(self, available):
+        if self.stories_per_cycle is not None:
+            return min(self.stories_per_cycle, available)
+        return rand.randint(
+            min(MIN_NUMBER_OF_HN_STORIES, available),
+            min(MAX_NUMBER_OF_HN_STORIES, available),
+        )
+
+    async def items(self, item_ids, cache=True):
+        # Fetches items concurrently and yields them in completion order
+        pending = [
+            asyncio.ensure_future(self.item(item_id, cache=cache))
+            for item_id in item_ids
+        ]
+        try:
+            for future in asyncio.as_completed(pending):
+                if story := await future:
+                    yield story
+        finally:
+            # Nobody is waiting for the rest if the caller stopped early
+            for task in pending:
+                task.cancel()
+
+    async def stories(self):
+        if self.incremental:
+            max_item = await self.max_item()
+            if self.cursor is not None and max_item is None:
+                # Keep the cursor and catch up on the next poll
+                return
+            if self.cursor is not None:
+                async for item in self._new_stories(max_item):
+                    yield item
+                return
+
+            # No cursor yet; sample the story lists once and poll from here
+            self.cursor = max_item
+
+        story_ids = await self.story_ids()
+        rand.shuffle(story_ids)
+        story_ids = story_ids[: self._number_of_stories(len(story_ids))]
+
+        async for story in self.items(story_ids):
+            if item := story_item(story):
+                yield item
+
+    async def _new_stories(self, max_item):
+        first = max(self.cursor + 1, max_item - HN_MAX_NEW_ITEMS + 1)
+        self.cursor = max(self.cursor, first - 1)
+        item_ids = iter(range(first, max_item + 1))
+
+        # Items are fetched a few ahead but handled oldest first, so the
+        # cursor never passes an item that was not looked at. When the cycle
+        # has its stories, the rest are left for the next one.
+        pending = deque()
+        count = 0
+        try:
+            while True:
+                while len(pending) < self.concurrency:
+                    if (item_id := next(item_ids, None)) is None:
+                        break
+                    # Items are fetched exactly once, so there is no point
+                    # caching them
+                    task = asyncio.ensure_future(self._get_json(f"item/{item_id}.json"))
+                    pending.append((item_id, task))
+                if not pending:
+                    return
+
+                item_id, task = pending.popleft()
+                try:
+                    story = await task
+                except Exception as e:
+                    # Stop short of the failed item so the next poll
+                    # fetches it again
+                    await self._item_error(item_id, e)
+                    return
+                self.cursor = item_id
+                if not story or story.get("type") != "story":
+                    continue
+                if item := story_item(story):
+                    yield item
+                    count += 1
+                    if (
+                        self.stories_per_cycle is not None
+                        and count >= self.stories_per_cycle
+                    ):
+                        return
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+
+def story_item(story):
+    story_time = story.get("time")
+    timestamp = datetime.fromtimestamp(story_time) if story_time else ""
+    if not validate_timestamp(timestamp):
+        return None
+
+    if not story.get("url"):
+        return None
+
+    return StreamItem(
+        story.get("by", ""),
+        timestamp,
+        story.get("title", ""),
+        (story.get("text") or "").replace("<p>", "\n"),
+        story.get("url", ""),
+    )
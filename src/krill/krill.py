@@ -10,23 +10,72 @@
 import argparse
 import asyncio
 import codecs
-import json
+import hashlib
 import os
 import random
 import re
+import signal
 import sys
-from datetime import datetime
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from urllib.parse import urlparse
 
 import httpx
 from blessings import Terminal
 
-from .feed.parser import StreamItem, StreamParser, TextExcerpter
-from .sources.lexer import filter_lex
-from .sources.parser import TokenParser
-from .utils import RandomQueue, get_time_logger, validate_timestamp
+from .cache import ValidatorCache
+from .client import (
+    HTTP2_AVAILABLE,
+    MAX_CONNECTIONS,
+    MAX_KEEPALIVE_CONNECTIONS,
+    ClientPool,
+)
+from .daemon import (
+    SOCKET_NAME,
+    DaemonRunning,
+    QueryServer,
+    error_response,
+    query,
+)
+from .feed.dates import date_parse_stats
+from .feed.fingerprint import dedup_keys
+from .feed.parser import (
+    StreamParser,
+    TextExcerpter,
+    entry_id,
+    parse_items,
+    unpack_items,
+)
+from .hackernews import HN_API_URL, HN_CONCURRENCY, HackerNewsSource, ItemCache
+from .metrics import Metrics
+from .output import (
+    SNAPSHOT_BUFFER_SIZE,
+    NDJSONWriter,
+    TerminalRenderer,
+    drain,
+    highlight,
+    merge_spans,
+    snapshot_record,
+)
+from .polling import PollingScheduler, split_source_options
+from .profiling import CycleProfiler
+from .scheduler import (
+    DOMAIN_LIMITS,
+    DomainScheduler,
+    limit_for,
+    parse_domain_limit,
+)
+from .sources.parser import TextBatch, compile_filter, first_matches, match_filters
+from .store import ItemStore, SeenStore
+from .utils import (
+    RandomQueue,
+    default_cache_dir,
+    get_time_logger,
+)
 
 PROXY = os.environ.get("KRILL_PROXY") or None
+HN_API = os.environ.get("KRILL_HN_API") or HN_API_URL
 
 rand = random.SystemRandom()
 
@@ -34,22 +83,16 @@ base_type_speed = 0.01
 
 REQUESTS_TIMEOUT = 10
 NUM_WORKERS = 3
-REQUEST_WORKER_SLEEP = 3
+FILTER_FIELDS = ("title", "text", "link")
+# Fewest filters worth handing to a filter worker process
+FILTER_SHARD_SIZE = 64
 REQUEST_RETRIES = 3
 RETRY_SLEEP = 1
-OVERRIDE_REQUEST_WORKERS = {"reddit": 1}
 EXCERPT_LENGTH = 500
-
-_invisible_codes = re.compile(
-    r"^(\x1b\[\d*m|\x1b\[\d*\;\d*\;\d*m|\x1b\(B)"
-)  # ANSI color codes
-
-
-HN_TOP_STORIES_URL = "https://hacker-news.firebaseio.com/v0/topstories.json"
-HN_NEW_STORIES_URL = "https://hacker-news.firebaseio.com/v0/newstories.json"
-HN_STORY_URL_TEMPLATE = "https://hacker-news.firebaseio.com/v0/item/{}.json"
-MIN_NUMBER_OF_HN_STORIES = 1
-MAX_NUMBER_OF_HN_STORIES = 5
+RELOAD_INTERVAL = 2
+# Ids of items turned down by the filters are remembered per source, up to
+# this many, so the parser can drop them on the next fetch
+MAX_REJECTED_ITEMS = 10_000
 
 
 OUTPUT_LOCK = asyncio.Lock()
@@ -57,6 +100,9 @@ OUTPUT_LOCK = asyncio.Lock()
 
 TERMINAL = Terminal()
 
+_hashtag_regex = re.compile(r"(?<!\w)([#@])(\w+)")
+_url_regex = re.compile(r"(\w+://)?[\w.-]+\.[a-zA-Z]{2,4}(?(1)|/)[\w#?&=%/:.-]*")
+
 
 class NoData(Exception):
     pass
@@ -69,7 +115,7 @@ class Quit(Exception):
 class Application:
     def __init__(self, args):
         self.item_count = 0
-        self._known_items = set()
+        self._known_items = SeenStore()
         self.args = args
         if self.args.text_speed_ave.lower() == "fast":
             self.text_speed_ave = 1
@@ -82,21 +128,144 @@ class Application:
             self.text_speed_ave = speed
 
         self.time_log = get_time_logger(self.args.verbose)
+        self.clients = ClientPool(
+            proxy=PROXY,
+            http2=self.args.http2,
+            max_connections=self.args.max_connections,
+            max_keepalive_connections=self.args.max_keepalive_connections,
+        )
+        self.validators = ValidatorCache()
+        self._schedulers = dict()
+        self._parse_pool = None
+        self._bloom_task = None
+        self._filter_pool = None
+        self._snapshot = NDJSONWriter()
+        self.metrics = Metrics()
+        self.profiler = CycleProfiler()
+        self.polling = None
+        # Daemon mode only
+        self.items_store = None
+        self._query_server = None
+        self.sources = []
+        self._compiled_filters = dict()
+        self._filter_labels = dict()
+        self._mtimes = dict()
+        self._rejected = defaultdict(set)
+        self._reload_task = None
+        # Held by each update so that a reload cannot start one mid-cycle
+        self._update_lock = asyncio.Lock()
+        self.hackernews = HackerNewsSource(
+            self.clients,
+            base_url=HN_API,
+            timeout=REQUESTS_TIMEOUT,
+            on_error=self._print_error,
+        )
 
         self.clear()
 
     async def populate_sources(self):
-        self.sources = []
+        # Returns the sources that were not there before. Filters are only
+        # compiled the first time their string is seen, so reloading a large
+        # filter file only costs as much as the lines that changed.
+        sources = []
+        source_options = dict()
         global_patterns = await self._global_patterns()
         for source, source_patterns in (await self._sources()).items():
+            try:
+                options, source_patterns = split_source_options(source_patterns)
+            except ValueError as error:
+                await self._print_error(f"Source '{source}': {error}")
+                sys.exit(1)
+            source_options[source] = options
+
             re_funcs = []
             if source_patterns:
-                tokens = filter_lex(source_patterns)
-                parser = TokenParser(tokens)
-                re_funcs = [parser.build()]
+                re_funcs = [await self._compile_filter(source_patterns)]
             else:
                 re_funcs = global_patterns
-            self.sources.append((source, re_funcs))
+            sources.append((source, re_funcs))
+
+        previous = {source for source, _ in self.sources}
+        self.sources = sources
+        # Items turned down before may match the new filters
+        self._rejected.clear()
+
+        # Forget filters that are no longer used
+        used = {id(re_func) for _, re_funcs in sources for re_func in re_funcs}
+        self._compiled_filters = {
+            filter_string: re_func
+            for filter_string, re_func in self._compiled_filters.items()
+            if id(re_func) in used
+        }
+        self._filter_labels = {
+            re_func: filter_string
+            for filter_string, re_func in self._compiled_filters.items()
+        }
+
+        if self.polling is not None:
+            for source in previous - source_options.keys():
+                self.polling.remove(source)
+            for source, options in source_options.items():
+                self.polling.add(source, options)
+
+        return [source for source, _ in sources if source not in previous]
+
+    async def _compile_filter(self, filter_string):
+        if filter_string not in self._compiled_filters:
+            try:
+                self._compiled_filters[filter_string] = compile_filter(filter_string)
+            except Exception as error:
+                await self._print_error(
+                    f"Error while compiling regular expression '{filter_string}': {error}"
+                )
+                sys.exit(1)
+        return self._compiled_filters[filter_string]
+
+    def _file_mtimes(self):
+        mtimes = dict()
+        for filename in (self.args.sources_file, self.args.filters_file):
+            if filename is None:
+                continue
+            try:
+                mtimes[filename] = os.stat(filename).st_mtime_ns
+            except OSError:
+                mtimes[filename] = None
+        return mtimes
+
+    async def reload_worker(self, interval=RELOAD_INTERVAL):
+        # Picks up edits to the sources and filters files while running and
+        # fetches newly added sources straight away
+        while True:
+            await asyncio.sleep(interval)
+
+            mtimes = self._file_mtimes()
+            if mtimes == self._mtimes:
+                continue
+            self._mtimes = mtimes
+
+            try:
+                # Not while a cycle is using the current sources and filters
+                async with self._update_lock:
+                    added = await self.populate_sources()
+            except SystemExit:
+                # Most likely caught halfway through being saved; the next
+                # change will be picked up again
+                await self._print_error("Keeping the previous sources and filters")
+                continue
+            except Exception as e:
+                await self._print_error(
+                    f"Reloading sources and filters: {e.__class__.__name__}: {e}"
+                )
+                continue
+
+            self.metrics.inc("reloads")
+            if added:
+                try:
+                    await self.update(added)
+                except Exception as e:
+                    await self._print_error(
+                        f"Updating new sources: {e.__class__.__name__}: {e}"
+                    )
 
     def clear(self):
         self.items = list()
@@ -106,17 +275,54 @@ class Application:
         self._hn_resp_queue = asyncio.Queue()
         self._html_resp_queue = asyncio.Queue()
         self._request_queues = dict()
-        self._semaphores = dict()
         self._links = dict()
         self._tasks = []
 
-    async def add_item(self, item, patterns=None):
-        item_id = (item.source, item.link)
-        if item_id in self._known_items:
+    @staticmethod
+    def _item_id(item):
+        return entry_id(item.source, item.guid, item.link)
+
+    def _is_known_entry(self, key):
+        source = key.partition("\t")[0]
+        if key in self._rejected[source] or key in self._known_items:
+            self.metrics.inc("items", stage="known")
+            return True
+        return False
+
+    def _reject(self, item):
+        rejected = self._rejected[item.source]
+        if len(rejected) >= MAX_REJECTED_ITEMS:
+            rejected.clear()
+        rejected.add(self._item_id(item))
+
+    def _rebuild_seen_filter(self):
+        # A large store takes seconds to hash, so that happens off the loop
+        store = self._known_items
+        if not store.needs_rebuild:
+            return
+        if store.path == ":memory:":
+            store.rebuild_bloom()
+        elif self._bloom_task is None or self._bloom_task.done():
+            self._bloom_task = asyncio.get_running_loop().run_in_executor(
+                None, store.rebuild_bloom
+            )
+
+    def _is_duplicate(self, item):
+        # Same item seen before, possibly via another source or with a
+        # differently decorated link
+        return self._item_id(item) in self._known_items or any(
+            key in self._known_items for key in dedup_keys(item)
+        )
+
+    async def add_item(self, item, spans=None):
+        if self._is_duplicate(item):
             # Do not print an item more than once
             return
-        self._known_items.add(item_id)
-        self._output_queue.put_nowait((item, patterns))
+        self._known_items.add(self._item_id(item))
+        for key in dedup_keys(item):
+            self._known_items.add(key)
+        self.metrics.inc("items", stage="accepted")
+        self._output_queue.put_nowait((item, spans))
 
     def text_speed(self, interval_ave):
         if interval_ave == 0:
@@ -130,55 +336,75 @@ class Application:
         async with OUTPUT_LOCK:
             print(TERMINAL.red(error), file=sys.stderr)
 
-    async def json_request_worker(self, queue, semaphore, output_queue):
+    async def json_request_worker(self, queue, scheduler, output_queue):
         while True:
-            await asyncio.sleep(REQUEST_WORKER_SLEEP)
-            if semaphore.locked():
-                continue
-
-            await semaphore.acquire()
             url, patterns = await queue.get()
+            domain = urlparse(url).netloc
 
             try:
-                async with httpx.AsyncClient(
-                    follow_redirects=True, proxy=PROXY
-                ) as client:
-                    resp = await client.get(url, timeout=REQUESTS_TIMEOUT)
-
+                async with scheduler:
+                    with self.metrics.timer("request_seconds", domain=domain):
+                        resp = await self.clients.get(url, timeout=REQUESTS_TIMEOUT)
+                self._record_response(domain, resp)
                 resp.raise_for_status()
                 output_queue.put_nowait((url, resp.json(), patterns))
             except Exception as e:
                 await self._print_error(str(e))
             finally:
-                semaphore.release()
                 queue.task_done()
 
-    async def html_request_worker(self, queue, semaphore, output_queue):
-        while True:
-            await asyncio.sleep(REQUEST_WORKER_SLEEP)
-            if semaphore.locked():
-                continue
+    def _filters_key(self, re_funcs):
+        # Validators are tied to the filters a feed was last parsed with, so
+        # that once they change, the feed is parsed again rather than
+        # answered with 304 Not Modified
+        filter_strings = "\n".join(
+            self._filter_labels.get(re_func, "") for re_func in re_funcs or ()
+        )
+        return hashlib.blake2b(filter_strings.encode(), digest_size=8).hexdigest()
 
-            await semaphore.acquire()
+    async def html_request_worker(self, queue, scheduler, output_queue):
+        while True:
             url, patterns = await queue.get()
+            domain = urlparse(url).netloc
 
             try:
                 for i in range(REQUEST_RETRIES):
                     try:
-                        await asyncio.sleep(RETRY_SLEEP)
+                        if i:
+                            await asyncio.sleep(RETRY_SLEEP)
+
+                        headers = {
+                            "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36",
+                        }
+                        headers.update(
+                            self.validators.headers(url, self._filters_key(patterns))
+                        )
 
-                        async with httpx.AsyncClient(
-                            follow_redirects=True, proxy=PROXY
-                        ) as client:
-                            headers = {
-                                "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/137.0.0.0 Safari/537.36",
-                            }
+                        with self.time_log(f"request {url}"):
+                            async with scheduler:
+                                with self.metrics.timer(
+                                    "request_seconds", domain=domain
+                                ):
+                                    resp = await self.clients.get(
+                                        url, timeout=REQUESTS_TIMEOUT, headers=headers
+                                    )
+                            self._record_response(domain, resp)
+                            if resp.status_code == httpx.codes.NOT_MODIFIED:
+                                # Nothing new since the last fetch; skip parsing
+                                self.validators.not_modified()
+                                if self.polling is not None:
+                                    self.polling.record_response(url, resp.headers)
+                                break
+                            resp.raise_for_status()
+
+                        if self.polling is not None:
+                            self.polling.record_response(
+                                url, resp.headers, resp.content
+                            )
 
-                            with self.time_log(f"request {url}"):
-                                resp = await client.get(
-                                    url, timeout=REQUESTS_TIMEOUT, headers=headers
-                                )
-                                resp.raise_for_status()
+                        self.validators.update(
+                            url, resp.headers, self._filters_key(patterns)
+                        )
 
                         if not resp.content.strip():
                             raise NoData("No data")
@@ -190,37 +416,51 @@ class Application:
                         httpx.ConnectTimeout,
                         httpx.ConnectError,
                     ) as e:
+                        self.metrics.inc(
+                            "request_errors", domain=domain, error=e.__class__.__name__
+                        )
                         await self._print_error(
                             f"Attempt {i}: {url} -> {e.__class__.__name__}: {e}"
                         )
                     except Exception as e:
+                        # Not worth retrying, but keep the worker alive for
+                        # the rest of the domain's queue
                         await self._print_error(
                             f"Attempt {i}: {url} -> {e.__class__.__name__}: {e}"
                         )
-                        raise
+                        break
             finally:
-                semaphore.release()
                 queue.task_done()
 
+    def _record_response(self, domain, resp):
+        self.metrics.inc("responses", domain=domain, status=resp.status_code)
+        self.metrics.inc("downloaded_bytes", len(resp.content), domain=domain)
+
+    def _sample_queue(self, name, queue):
+        # Backlog left behind each item as it is picked up
+        self.metrics.observe("queue_depth", queue.qsize(), queue=name)
+
+    def _scheduler(self, domain):
+        if domain not in self._schedulers:
+            limits = dict(DOMAIN_LIMITS)
+            limits.update(self.args.domain_limit or ())
+            self._schedulers[domain] = DomainScheduler(limit_for(domain, limits))
+        return self._schedulers[domain]
+
     async def _queue_request(self, url, patterns):
         domain = urlparse(url).netloc
         if domain not in self._request_queues:
             self._request_queues[domain] = asyncio.Queue()
-            for dom, value in OVERRIDE_REQUEST_WORKERS.items():
-                if dom.lower() in domain:
-                    num_workers = value
-                    break
-            else:
-                num_workers = NUM_WORKERS
-
-            self._semaphores[domain] = asyncio.Semaphore(num_workers)
+            scheduler = self._scheduler(domain)
 
-            for _ in range(num_workers):
+            # Workers block on the queue and are only held back by the
+            # domain's concurrency and rate limits
+            for _ in range(scheduler.limit.concurrency):
                 if "hackernews" in domain.lower() or "hacker-news" in domain.lower():
                     task = asyncio.create_task(
                         self.json_request_worker(
                             self._request_queues[domain],
-                            self._semaphores[domain],
+                            scheduler,
                             self._hn_resp_queue,
                         )
                     )
@@ -228,7 +468,7 @@ class Application:
                     task = asyncio.create_task(
                         self.html_request_worker(
                             self._request_queues[domain],
-                            self._semaphores[domain],
+                            scheduler,
                             self._html_resp_queue,
                         )
                     )
@@ -236,74 +476,6 @@ class Application:
 
         self._request_queues[domain].put_nowait((url, patterns))
 
-    @classmethod
-    async def _hn_story_ids(cls, url, cb=None):
-        try:
-            async with httpx.AsyncClient(follow_redirects=True, proxy=PROXY) as client:
-                resp = await client.get(url, timeout=REQUESTS_TIMEOUT)
-            story_ids = resp.json()
-        except Exception as e:
-            await cls._print_error(str(e))
-            story_ids = []
-
-        if cb and story_ids:
-            cb(story_ids)
-        return story_ids
-
-    @classmethod
-    async def hn_stories_generator(cls):
-        story_ids = set()
-
-        def extend_story_ids(ids):
-            story_ids.update(ids)
-
-        async with asyncio.TaskGroup() as tg:
-            tg.create_task(cls._hn_story_ids(HN_TOP_STORIES_URL, cb=extend_story_ids))
-            tg.create_task(cls._hn_story_ids(HN_NEW_STORIES_URL, cb=extend_story_ids))
-
-        story_ids = list(story_ids)
-
-        rand.shuffle(story_ids)
-
-        number_of_stories = len(story_ids)
-        if not number_of_stories:
-            yield ()
-
-        number_of_stories = rand.randint(
-            min(MIN_NUMBER_OF_HN_STORIES, number_of_stories),
-            min(MAX_NUMBER_OF_HN_STORIES, number_of_stories),
-        )
-
-        for story_id in story_ids[:number_of_stories]:
-            try:
-                async with httpx.AsyncClient(
-                    follow_redirects=True, proxy=PROXY
-                ) as client:
-                    resp = await client.get(
-                        HN_STORY_URL_TEMPLATE.format(story_id), timeout=REQUESTS_TIMEOUT
-                    )
-            except Exception as e:
-                await cls._print_error("Error getting HackerNews stories")
-                await cls._print_error(str(e))
-                break
-            story = resp.json()
-            if not story:
-                continue
-            story_time = story.get("time")
-
-            timestamp = datetime.fromtimestamp(story_time) if story_time else ""
-            if not validate_timestamp(timestamp):
-                continue
-
-            if story.get("url"):
-                yield StreamItem(
-                    story.get("by", ""),
-                    timestamp,
-                    story.get("title", ""),
-                    story.get("text", "").replace("<p>", "\n"),
-                    story.get("url", ""),
-                )
-
     @classmethod
     async def _read_sources_file(cls, filename):
         output = dict()
@@ -348,27 +520,38 @@ class Application:
         ]
 
     @staticmethod
-    async def _highlight_pattern(text, patterns, pattern_style, text_style=None):
-        if patterns is None:
-            return text if text_style is None else text_style(text)
-        for pattern in patterns:
-            if isinstance(pattern, str):
-                regex = re.compile(pattern)
-            else:
-                regex = pattern
-
-            if text_style is None:
-                text = regex.sub(pattern_style("\\g<0>"), text)
-            else:
-                text = text_style(regex.sub(pattern_style("\\g<0>") + text_style, text))
-        return text
+    def _decorations(text):
+        # Hashtags, mentions and URLs in one of the forms commonly encountered
+        # on the web, found over the whole text so that highlighting a match
+        # inside one does not break it up. URLs win over the #fragment
+        # inside them.
+        urls = [
+            (*found.span(), TERMINAL.magenta_underline)
+            for found in _url_regex.finditer(text)
+        ]
+        tags = [
+            (*found.span(), TERMINAL.green)
+            for found in _hashtag_regex.finditer(text)
+            if not any(
+                start < found.end() and found.start() < end for start, end, _ in urls
+            )
+        ]
+        return sorted(urls + tags, key=lambda decoration: decoration[0])
 
-    async def _queue_item(self, item, patterns=None):
+    async def _queue_item(self, item, spans=None):
+        # spans maps title, text and link to the (start, end) pairs matched by
+        # the filter, or is None when there were no filters
+        spans = spans or dict()
         entry = []
         self.item_count += 1
 
+        if self.items_store is not None:
+            self.items_store.add(self._item_id(item), snapshot_record(item))
+            return
+
         if self.args.snapshot:
-            snapshot_item = dict()
+            self._snapshot.write(snapshot_record(item))
+            return
 
         time_label = (
             " on {} at {}".format(
@@ -379,52 +562,36 @@ class Application:
             else ""
         )
 
-        if not self.args.snapshot:
-            entry.append(
-                "{}. {}{}:".format(
-                    self.item_count, TERMINAL.cyan(item.source), time_label
-                )
-            )
+        entry.append(
+            "{}. {}{}:".format(self.item_count, TERMINAL.cyan(item.source), time_label)
+        )
 
         indent = " " * (len(str(self.item_count)) + 2)
 
         if item.title is not None:
-            if not self.args.snapshot:
-                entry.append(
-                    "{}{}".format(
-                        indent,
-                        await self._highlight_pattern(
-                            item.title,
-                            patterns,
-                            TERMINAL.bold_black_on_bright_yellow,
-                            TERMINAL.bold,
-                        ),
-                    )
+            entry.append(
+                "{}{}".format(
+                    indent,
+                    highlight(
+                        item.title,
+                        merge_spans(spans.get("title")),
+                        TERMINAL.bold_black_on_bright_yellow,
+                        TERMINAL.bold,
+                    ),
                 )
-            else:
-                snapshot_item["title"] = item.title
-
-        if item.text is not None and not self.args.snapshot:
-            (excerpt, clipped_left, clipped_right) = await TextExcerpter.get_excerpt(
-                item.text, EXCERPT_LENGTH, patterns
             )
 
-            # Hashtag or mention
-            excerpt = re.sub(
-                r"(?<!\w)([#@])(\w+)",
-                TERMINAL.green("\\g<1>") + TERMINAL.green("\\g<2>"),
-                excerpt,
+        if item.text is not None:
+            excerpt, clipped_left, clipped_right, excerpt_spans = (
+                await TextExcerpter.get_excerpt(
+                    item.text, EXCERPT_LENGTH, merge_spans(spans.get("text"))
+                )
             )
-
-            # URL in one of the forms commonly encountered on the web
-            excerpt = re.sub(
-                r"(\w+://)?[\w.-]+\.[a-zA-Z]{2,4}(?(1)|/)[\w#?&=%/:.-]*",
-                TERMINAL.magenta_underline("\\g<0>"),
+            excerpt = highlight(
                 excerpt,
-            )
-
-            excerpt = await self._highlight_pattern(
-                excerpt, patterns, TERMINAL.black_on_yellow
+                excerpt_spans,
+                TERMINAL.black_on_yellow,
+                decorations=self._decorations(excerpt),
             )
 
             entry.append(
@@ -438,27 +605,21 @@ class Application:
 
         if item.link is not None:
             self._links[self.item_count] = item.link
-            if not self.args.snapshot:
-                entry.append(
-                    "{}{}".format(
-                        indent,
-                        await self._highlight_pattern(
-                            item.link,
-                            patterns,
-                            TERMINAL.black_on_yellow_underline,
-                            TERMINAL.blue_underline,
-                        ),
-                    )
+            entry.append(
+                "{}{}".format(
+                    indent,
+                    highlight(
+                        item.link,
+                        merge_spans(spans.get("link")),
+                        TERMINAL.black_on_yellow_underline,
+                        TERMINAL.blue_underline,
+                    ),
                 )
-            else:
-                snapshot_item["link"] = item.link
+            )
 
         entry.append("\n")
 
-        if self.args.snapshot:
-            self._queue.put_nowait(snapshot_item)
-        else:
-            self._queue.put_nowait("\n".join(entry))
+        self._queue.put_nowait("\n".join(entry))
 
     async def source_request_worker(self, queue):
         while True:
@@ -468,94 +629,205 @@ class Application:
                 if "hackernews" not in url.lower():
                     await self._queue_request(url, patterns)
                 else:
-                    async for stream_data in self.hn_stories_generator():
-                        self._items_queue.put_nowait((stream_data, patterns))
+                    timestamps = []
+                    async for stream_data in self.hackernews.stories():
+                        self.metrics.inc("items", stage="parsed")
+                        self._items_queue.put_nowait(([stream_data], patterns))
+                        timestamps.append(stream_data.time)
+                    if self.polling is not None:
+                        self.polling.record_items(url, timestamps)
+            except Exception as e:
+                await self._print_error(f"{url} -> {e.__class__.__name__}: {e}")
             finally:
                 queue.task_done()
 
     async def html_source_worker(self):
         while True:
             url, data, patterns = await self._html_resp_queue.get()
+            self._sample_queue("responses", self._html_resp_queue)
 
             try:
-                if "//x.com/" in url:
-                    async for stream_data in StreamParser.get_tweets(data):
-                        self._items_queue.put_nowait((stream_data, patterns))
-                else:
-                    async for stream_data in StreamParser.get_feed_items(data, url):
-                        self._items_queue.put_nowait((stream_data, patterns))
+                items = []
+                with self.metrics.timer("parse_seconds", feed=url):
+                    if self._parse_pool is not None:
+                        # Workers cannot reach the seen store, so they get the
+                        # ids already known for this source instead. Those
+                        # entries are not refreshed, but they go on to fail the
+                        # date check before their seen store entry expires.
+                        source = urlparse(url).netloc
+                        known = self._known_items.keys(f"{source}\t")
+                        known |= self._rejected[source]
+                        batch = await asyncio.get_running_loop().run_in_executor(
+                            self._parse_pool, parse_items, data, url, known
+                        )
+                        items = unpack_items(batch)
+                    else:
+                        async for stream_data in StreamParser.get_items(
+                            data, url, self._is_known_entry
+                        ):
+                            items.append(stream_data)
+
+                # The whole feed is filtered as one batch
+                if items:
+                    self._items_queue.put_nowait((items, patterns))
+                self.metrics.inc("items", len(items), stage="parsed")
+                if self.polling is not None:
+                    self.polling.record_items(url, [item.time for item in items])
+            except Exception as e:
+                await self._print_error(f"{url} -> {e.__class__.__name__}: {e}")
             finally:
                 self._html_resp_queue.task_done()
 
+    def _filter_shards(self, re_funcs):
+        # Splits the filters into runs of filter strings, one per filter
+        # worker, or returns None when they are better run right here
+        if self._filter_pool is None:
+            return None
+        count = min(self.args.filter_workers, len(re_funcs) // FILTER_SHARD_SIZE)
+        if count < 2:
+            return None
+
+        filter_strings = [self._filter_labels.get(re_func) for re_func in re_funcs]
+        if None in filter_strings:
+            return None
+        size = -(-len(filter_strings) // count)
+        return [
+            filter_strings[start : start + size]
+            for start in range(0, len(filter_strings), size)
+        ]
+
+    async def _filter_batch(self, fields, re_funcs):
+        # Runs the filters over the title, text and link of all items at
+        # once, given as one tuple per item. As with single items, the first
+        # filter to match any field decides which spans are highlighted.
+        # Returns the spans by item index.
+        texts = {
+            name: [item_fields[idx] for item_fields in fields]
+            for idx, name in enumerate(FILTER_FIELDS)
+        }
+        if (shards := self._filter_shards(re_funcs)) is not None:
+            return await self._filter_batch_pooled(shards, texts)
+
+        matched = dict()
+        batches = {name: TextBatch(field_texts) for name, field_texts in texts.items()}
+        for position, checked, hits, spans in first_matches(re_funcs, batches):
+            label = self._filter_labels.get(re_funcs[position], "")
+            self.metrics.inc("filter_checks", checked.bit_count(), filter=label)
+            self.metrics.inc("filter_hits", hits.bit_count(), filter=label)
+            matched.update(spans)
+        return matched
+
+    async def _filter_batch_pooled(self, shards, texts):
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(
+            *(
+                loop.run_in_executor(self._filter_pool, match_filters, shard, texts)
+                for shard in shards
+            )
+        )
+
+        # Each shard reports the first of its own filters to match an item;
+        # the earliest filter over all shards wins
+        matched = dict()
+        offset = 0
+        for shard, (counts, shard_matched) in zip(shards, results):
+            for position, checks, hits in counts:
+                self.metrics.inc("filter_checks", checks, filter=shard[position])
+                self.metrics.inc("filter_hits", hits, filter=shard[position])
+            for index, (position, spans) in shard_matched.items():
+                if index not in matched or offset + position < matched[index][0]:
+                    matched[index] = (offset + position, spans)
+            offset += len(shard)
+        return {index: spans for index, (_, spans) in matched.items()}
+
     async def stream_worker(self, queue):
+        # Takes the items of one feed at a time
         while True:
-            item, re_funcs = await queue.get()
+            items, re_funcs = await queue.get()
+            self._sample_queue("items", queue)
 
             try:
-                if re_funcs:
-                    for re_func in re_funcs:
-                        title_matches = (
-                            item.title is not None
-                            and re_func(item.title)
-                            or (False, set())
-                        )
-                        text_matches = (
-                            item.text is not None
-                            and re_func(item.text)
-                            or (False, set())
+                fresh = []
+                fields = []
+                for item in items:
+                    try:
+                        if self._is_duplicate(item):
+                            # Checked before any filter reads the item's text,
+                            # so known items never have their HTML converted
+                            self.metrics.inc("items", stage="duplicate")
+                            # Remember this entry's own id too, so that the
+                            # parser can drop it next time
+                            self._known_items.add(self._item_id(item))
+                            continue
+                        if re_funcs:
+                            fields.append(
+                                tuple(getattr(item, name) for name in FILTER_FIELDS)
+                            )
+                        fresh.append(item)
+                    except Exception as e:
+                        # Only this item is lost, not the rest of its feed
+                        await self._print_error(
+                            f"Item {item.link}: {e.__class__.__name__}: {e}"
                         )
-                        link_matches = (
-                            item.link is not None
-                            and re_func(item.link)
-                            or (False, set())
+
+                matched = None
+                if re_funcs:
+                    matched = await self._filter_batch(fields, re_funcs)
+                for index, item in enumerate(fresh):
+                    try:
+                        if matched is None:
+                            # No filter patterns specified; simply print all
+                            # items
+                            await self.add_item(item)
+                        elif index in matched:
+                            await self.add_item(item, matched[index])
+                        else:
+                            self.metrics.inc("items", stage="rejected")
+                            self._reject(item)
+                    except Exception as e:
+                        await self._print_error(
+                            f"Item {item.link}: {e.__class__.__name__}: {e}"
                         )
-                        if title_matches[0] or text_matches[0] or link_matches[0]:
-                            matched_texts = set()
-                            matched_texts.update(
-                                title_matches[1], text_matches[1], link_matches[1]
-                            )
-                            await self.add_item(item, matched_texts)
-                            break
-                else:
-                    # No filter patterns specified; simply print all items
-                    await self.add_item(item)
             except Exception as e:
-                await self._print_error(f"Item {item}: {e.__class__.__name__}: {e}")
+                await self._print_error(
+                    f"Items from {items[0].source}: {e.__class__.__name__}: {e}"
+                )
             finally:
                 queue.task_done()
 
     async def output_worker(self, queue):
         while True:
             item = await queue.get()
+            self._sample_queue("output", queue)
             try:
                 await self._queue_item(item[0], item[1])
+                self.metrics.inc("items", stage="rendered")
+            except Exception as e:
+                await self._print_error(f"Item {item[0]}: {e.__class__.__name__}: {e}")
             finally:
                 queue.task_done()
 
     async def flush_worker(self, queue, interval=0.1):
+        if interval:
+            renderer = TerminalRenderer(sys.stdout, lambda: self.text_speed(interval))
+        else:
+            renderer = TerminalRenderer(sys.stdout)
+
         while True:
-            text = await queue.get()
+            if renderer.delay is None:
+                batch = drain(queue, await queue.get())
+            else:
+                batch = [await queue.get()]
 
+            self._sample_queue("flush", queue)
             try:
-                async with OUTPUT_LOCK:
-                    if not self.args.snapshot:
-                        idx = 0
-                        while idx < len(text):
-                            await asyncio.sleep(self.text_speed(interval))
-                            if match := re.search(_invisible_codes, text[idx:]):
-                                end = idx + match.span()[1]
-                                sys.stdout.write(text[idx:end])
-                                idx = end
-                            else:
-                                sys.stdout.write(text[idx])
-                                idx += 1
-                            sys.stdout.flush()
-                        sys.stdout.write("\n")
-                        sys.stdout.flush()
-                    else:
-                        print(json.dumps(text))
+                with self.metrics.timer("flush_seconds"):
+                    async with OUTPUT_LOCK:
+                        await renderer.write(batch)
+                self.metrics.inc("items", len(batch), stage="flushed")
             finally:
-                queue.task_done()
+                for _ in batch:
+                    queue.task_done()
 
     async def _sources(self):
         # Reload sources and filters to allow for live editing
@@ -585,24 +857,28 @@ class Application:
 
         global_patterns = list()
         for filter_string in filters:
-            try:
-                tokens = filter_lex(filter_string)
-                parser = TokenParser(tokens)
-                global_patterns.append(parser.build())
-            except Exception as error:
-                await self._print_error(
-                    f"Error while compiling regular expression '{filter_string}': {error}"
-                )
-                sys.exit(1)
+            global_patterns.append(await self._compile_filter(filter_string))
 
         return global_patterns
 
-    async def update(self):
+    async def update(self, sources=None):
+        async with self._update_lock:
+            with self.profiler.cycle():
+                await self._update(sources)
+
+    async def _update(self, sources=None):
+        # Only the given sources are fetched, or all of them by default
+        start = time.perf_counter()
         self.clear()
 
         source_queue = asyncio.Queue()
 
-        for source, source_patterns in self.sources:
+        selected = [
+            (source, source_patterns)
+            for source, source_patterns in self.sources
+            if sources is None or source in sources
+        ]
+        for source, source_patterns in selected:
             source_queue.put_nowait((source, source_patterns))
 
         self.items = list()
@@ -623,27 +899,186 @@ class Application:
         task = asyncio.create_task(self.flush_worker(self._queue, self.text_speed_ave))
         self._tasks.append(task)
 
-        await asyncio.sleep(REQUESTS_TIMEOUT)
+        # Every stage queues its results downstream before marking its own
+        # work as done, so joining the stages in pipeline order guarantees
+        # that nothing is still in flight once the last queue has drained.
         await source_queue.join()
+        for queue in list(self._request_queues.values()):
+            await queue.join()
         await self._hn_resp_queue.join()
         await self._html_resp_queue.join()
         await self._items_queue.join()
         await self._output_queue.join()
         await self._queue.join()
 
-        for queue in self._request_queues.values():
-            await queue.join()
-
         for task in self._tasks:
             task.cancel()
 
         # Wait until all worker self._tasks are cancelled.
         await asyncio.gather(*self._tasks, return_exceptions=True)
 
+        self._snapshot.flush()
+        self.hackernews.save()
+        self.validators.save()
+        self._known_items.evict()
+        self._known_items.commit()
+        self._rebuild_seen_filter()
+        if self.items_store is not None:
+            self.items_store.evict()
+            self.items_store.commit()
+
+        if self.polling is not None:
+            for source, _ in selected:
+                self.polling.schedule(source)
+                self.metrics.set(
+                    "poll_interval_seconds",
+                    self.polling.interval(source),
+                    source=source,
+                )
+
+        self.metrics.observe("cycle_seconds", time.perf_counter() - start)
+        self._record_stats()
+        self.metrics.write(self.args.stats_json, self.args.stats_prometheus)
+
+        if self.args.verbose:
+            await self._print_stats()
+
+    def _record_stats(self):
+        # Counters kept by the other components, copied over once per cycle
+        for domain, stats in self.clients.stats().items():
+            for name, value in stats.items():
+                self.metrics.set(f"http_{name}", value, domain=domain)
+        self.metrics.set("http_connection_reuse_ratio", self.clients.reuse_ratio())
+        for method, count in date_parse_stats().items():
+            self.metrics.set("dates_parsed", count, method=method)
+        self.metrics.set("feeds_not_modified", self.validators.hits)
+        self.metrics.set("feeds_modified", self.validators.misses)
+
+    async def _print_stats(self):
+        async with OUTPUT_LOCK:
+            for domain, stats in self.clients.stats().items():
+                print(
+                    f"{domain}: {stats['requests']} requests, "
+                    f"{stats['connections']} connections, {stats['reused']} reused",
+                    file=sys.stderr,
+                )
+            print(
+                f"Connection reuse: {self.clients.reuse_ratio():.0%}", file=sys.stderr
+            )
+            print(
+                "Dates parsed: "
+                + ", ".join(
+                    f"{name} {count}" for name, count in date_parse_stats().items()
+                ),
+                file=sys.stderr,
+            )
+            print(
+                f"Not modified: {self.validators.hits} of "
+                f"{self.validators.hits + self.validators.misses} feeds",
+                file=sys.stderr,
+            )
+
+    async def _query_daemon(self):
+        filters = list(self.args.filters or ())
+        if self.args.filters_file is not None:
+            filters.extend(await self._read_filters_file(self.args.filters_file))
+
+        try:
+            response = await query(self.args.socket, {"filters": filters})
+        except OSError as error:
+            await self._print_error(f"Unable to query '{self.args.socket}': {error}")
+            sys.exit(1)
+
+        if (error := error_response(response)) is not None:
+            await self._print_error(error)
+            sys.exit(1)
+
+        if self.args.snapshot_output in (None, "-"):
+            sys.stdout.write(response)
+            sys.stdout.flush()
+        else:
+            with open(self.args.snapshot_output, "w", encoding="utf-8") as myfile:
+                myfile.write(response)
+
     async def run(self):
+        if self.args.snapshot and self.args.socket:
+            # Answered by a running daemon instead of fetching anything
+            await self._query_daemon()
+            return
+
+        # A snapshot should always report everything currently in the feeds,
+        # so state from previous runs is only used when following them
+        if not self.args.snapshot and not self.args.no_http_cache:
+            self.validators = ValidatorCache(
+                os.path.join(self.args.cache_dir, "validators.json")
+            ).load()
+
+        if not self.args.snapshot and not self.args.no_seen_store:
+            os.makedirs(self.args.cache_dir, exist_ok=True)
+            self._known_items = SeenStore(os.path.join(self.args.cache_dir, "seen.db"))
+            self._rebuild_seen_filter()
+
+        if self.args.snapshot and self.args.snapshot_output not in (None, "-"):
+            self._snapshot = NDJSONWriter(
+                open(
+                    self.args.snapshot_output,
+                    "w",
+                    encoding="utf-8",
+                    buffering=SNAPSHOT_BUFFER_SIZE,
+                )
+            )
+
+        self.hackernews = HackerNewsSource(
+            self.clients,
+            cache=ItemCache(
+                None
+                if self.args.snapshot
+                else os.path.join(self.args.cache_dir, "hn_items.json")
+            ).load(),
+            stories=self.args.hn_stories,
+            concurrency=self.args.hn_concurrency,
+            base_url=HN_API,
+            timeout=REQUESTS_TIMEOUT,
+            incremental=self.args.hn_incremental,
+            cursor_path=(
+                None
+                if self.args.snapshot
+                else os.path.join(self.args.cache_dir, "hn_cursor.json")
+            ),
+            on_error=self._print_error,
+        ).load()
+
+        if self.args.profile or self.args.profile_top:
+            self.profiler = CycleProfiler(self.args.profile, self.args.profile_top)
+
+        if self.args.adaptive_polling and self.args.update_interval > 0:
+            self.polling = PollingScheduler(self.args.update_interval)
+
+        if self.args.daemon:
+            self.items_store = ItemStore(os.path.join(self.args.cache_dir, "items.db"))
+            try:
+                self._query_server = await QueryServer(
+                    self.items_store,
+                    self.args.socket or os.path.join(self.args.cache_dir, SOCKET_NAME),
+                ).start()
+            except DaemonRunning as error:
+                self.items_store.close()
+                await self._print_error(str(error))
+                sys.exit(1)
+            # Shut down cleanly, removing the socket, when asked to stop
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGTERM, asyncio.current_task().cancel
+            )
+
+        if self.args.parse_workers > 0:
+            self._parse_pool = ProcessPoolExecutor(self.args.parse_workers)
+        if self.args.filter_workers > 0:
+            self._filter_pool = ProcessPoolExecutor(self.args.filter_workers)
+
+        self._mtimes = self._file_mtimes()
         await self.populate_sources()
 
-        if not self.args.snapshot:
+        if not self.args.snapshot and not self.args.daemon:
             print(
                 "{} ({})".format(
                     TERMINAL.bold("krill 0.5.1"),
@@ -662,7 +1097,16 @@ class Application:
             if self.args.snapshot:
                 return
 
-            if self.args.update_interval > 0:
+            if self.args.update_interval > 0 and self._mtimes:
+                self._reload_task = asyncio.create_task(self.reload_worker())
+
+            if self.args.update_interval > 0 and self.polling is not None:
+                # Each source is fetched as soon as it falls due
+                while True:
+                    await asyncio.sleep(max(self.polling.next_due() - time.time(), 0))
+
+                    await self.update(self.polling.due())
+            elif self.args.update_interval > 0:
                 while True:
                     await asyncio.sleep(self.args.update_interval)
 
@@ -670,6 +1114,27 @@ class Application:
         except (KeyboardInterrupt, Quit, asyncio.exceptions.CancelledError):
             # Do not print stacktrace if user exits with Ctrl+C
             sys.exit()
+        finally:
+            if self._reload_task is not None:
+                self._reload_task.cancel()
+            if self._query_server is not None:
+                await self._query_server.close()
+            if self.items_store is not None:
+                self.items_store.close()
+            await self.clients.aclose()
+            self._known_items.close()
+            self._snapshot.close()
+            if self._parse_pool is not None:
+                self._parse_pool.shutdown(cancel_futures=True)
+            if self._filter_pool is not None:
+                self._filter_pool.shutdown(cancel_futures=True)
+
+
+def _domain_limit(spec):
+    try:
+        return parse_domain_limit(spec)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
 
 
 def main():
@@ -712,7 +1177,27 @@ def main():
     arg_parser.add_argument(
         "--snapshot",
         action="store_true",
-        help="return a single snapshot of all headlines in json format",
+        help="return a single snapshot of all items in json format, one per line",
+    )
+    arg_parser.add_argument(
+        "-o",
+        "--snapshot-output",
+        default="-",
+        help="file or pipe to write the snapshot to as newline-delimited json "
+        + "(default: standard output)",
+        metavar="FILE",
+    )
+    arg_parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="keep fetching in the background and answer snapshot queries "
+        + "from the stored items over a Unix socket",
+    )
+    arg_parser.add_argument(
+        "--socket",
+        help="Unix socket of the daemon; with --snapshot, query a running daemon "
+        + f"instead of fetching (default for --daemon: CACHE_DIR/{SOCKET_NAME})",
+        metavar="PATH",
     )
     arg_parser.add_argument(
         "-u",
@@ -723,6 +1208,13 @@ def main():
         + "(default: 300 seconds, 0 for single pull only)",
         metavar="SECONDS",
     )
+    arg_parser.add_argument(
+        "--adaptive-polling",
+        action="store_true",
+        help="fetch each source on its own schedule, learned from how often it "
+        + "posts and what its caching headers allow; the update interval is "
+        + "used until a source's posting rate is known",
+    )
     arg_parser.add_argument(
         "-t",
         "--text-speed-ave",
@@ -736,13 +1228,131 @@ def main():
         action="store_true",
         help="display debugging messages",
     )
+    arg_parser.add_argument(
+        "--hn-stories",
+        type=int,
+        help="number of Hacker News stories to fetch per update "
+        + "(default: a random handful)",
+        metavar="N",
+    )
+    arg_parser.add_argument(
+        "--hn-concurrency",
+        default=HN_CONCURRENCY,
+        type=int,
+        help="maximum concurrent Hacker News requests "
+        + f"(default: {HN_CONCURRENCY})",
+        metavar="N",
+    )
+    arg_parser.add_argument(
+        "--hn-incremental",
+        action="store_true",
+        help="only fetch Hacker News stories posted since the previous update",
+    )
+    arg_parser.add_argument(
+        "--parse-workers",
+        default=0,
+        type=int,
+        help="parse feeds in N worker processes "
+        + "(default: 0, parse on the main thread)",
+        metavar="N",
+    )
+    arg_parser.add_argument(
+        "--filter-workers",
+        default=0,
+        type=int,
+        help="split large sets of filters across N worker processes "
+        + "(default: 0, filter on the main thread)",
+        metavar="N",
+    )
+    arg_parser.add_argument(
+        "--stats-json",
+        help="write pipeline metrics to FILE as json after every update",
+        metavar="FILE",
+    )
+    arg_parser.add_argument(
+        "--stats-prometheus",
+        help="write pipeline metrics to FILE in the Prometheus text format "
+        + "after every update",
+        metavar="FILE",
+    )
+    arg_parser.add_argument(
+        "--profile",
+        help="profile every update and write the stats to "
+        + "DIR/cycle-NNNN.pstats (inspect with python -m pstats)",
+        metavar="DIR",
+    )
+    arg_parser.add_argument(
+        "--profile-top",
+        default=0,
+        type=int,
+        help="print the N most expensive functions after every update",
+        metavar="N",
+    )
+    arg_parser.add_argument(
+        "--cache-dir",
+        default=default_cache_dir(),
+        help="directory for data kept between runs (default: %(default)s)",
+        metavar="DIR",
+    )
+    arg_parser.add_argument(
+        "--no-http-cache",
+        action="store_true",
+        help="do not persist ETag/Last-Modified validators between runs",
+    )
+    arg_parser.add_argument(
+        "--no-seen-store",
+        action="store_true",
+        help="do not remember printed items between runs",
+    )
+    arg_parser.add_argument(
+        "--domain-limit",
+        nargs="+",
+        type=_domain_limit,
+        help="per-domain request limits, e.g. reddit=1/0.5 for one request "
+        + "at a time and at most one every two seconds",
+        metavar="DOMAIN=N[/RATE]",
+    )
+    arg_parser.add_argument(
+        "--http2",
+        action="store_true",
+        help="multiplex requests over HTTP/2 where supported (requires h2)",
+    )
+    arg_parser.add_argument(
+        "--max-connections",
+        default=MAX_CONNECTIONS,
+        type=int,
+        help=f"maximum open connections per domain (default: {MAX_CONNECTIONS})",
+        metavar="N",
+    )
+    arg_parser.add_argument(
+        "--max-keepalive-connections",
+        default=MAX_KEEPALIVE_CONNECTIONS,
+        type=int,
+        help="maximum idle connections kept alive per domain "
+        + f"(default: {MAX_KEEPALIVE_CONNECTIONS})",
+        metavar="N",
+    )
     args = arg_parser.parse_args()
 
-    if args.sources is None and args.sources_file is None:
+    if args.daemon and args.snapshot:
+        arg_parser.error("--daemon and --snapshot cannot be combined")
+
+    if args.daemon and args.update_interval <= 0:
+        arg_parser.error("--daemon needs an update interval above zero")
+
+    # Snapshots from a running daemon need no sources of their own
+    if (
+        args.sources is None
+        and args.sources_file is None
+        and not (args.snapshot and args.socket)
+    ):
         arg_parser.error(
             "either a source URL (-s) or a sources file (-S) must be given"
         )
 
+    if args.http2 and not HTTP2_AVAILABLE:
+        arg_parser.error("--http2 requires the h2 package (pip install httpx[http2])")
+
     asyncio.run(Application(args).run())
 
 
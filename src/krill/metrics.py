@@ -0,0 +1,137 @@
+import json
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+PROMETHEUS_PREFIX = "krill_"
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class _Summary:
+    __slots__ = ("count", "sum", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+
+class Metrics:
+    # Counters and summaries accumulate over the life of the process, gauges
+    # hold the latest value. All of them can be exported as json or in the
+    # Prometheus text format.
+    def __init__(self):
+        self._counters = defaultdict(float)
+        self._gauges = dict()
+        self._summaries = defaultdict(_Summary)
+
+    def inc(self, name, value=1, **labels):
+        self._counters[_key(name, labels)] += value
+
+    def set(self, name, value, **labels):
+        self._gauges[_key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        self._summaries[_key(name, labels)].observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter(self, name, **labels):
+        return self._counters.get(_key(name, labels), 0)
+
+    def summary(self, name, **labels):
+        return self._summaries.get(_key(name, labels))
+
+    def as_dict(self):
+        output = {"counters": [], "gauges": [], "summaries": []}
+        for (name, labels), value in sorted(self._counters.items()):
+            output["counters"].append(
+                {"name": name, "labels": dict(labels), "value": value}
+            )
+        for (name, labels), value in sorted(self._gauges.items()):
+            output["gauges"].append(
+                {"name": name, "labels": dict(labels), "value": value}
+            )
+        for (name, labels), summary in sorted(self._summaries.items()):
+            output["summaries"].append(
+                {
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": summary.count,
+                    "sum": summary.sum,
+                    "max": summary.max,
+                }
+            )
+        return output
+
+    def prometheus(self):
+        lines = []
+        declared = set()
+
+        def metric_type(name, kind):
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(self._counters.items()):
+            name = f"{PROMETHEUS_PREFIX}{name}_total"
+            metric_type(name, "counter")
+            lines.append(f"{name}{_prometheus_labels(labels)} {value:g}")
+
+        for (name, labels), value in sorted(self._gauges.items()):
+            name = f"{PROMETHEUS_PREFIX}{name}"
+            metric_type(name, "gauge")
+            lines.append(f"{name}{_prometheus_labels(labels)} {value:g}")
+
+        summaries = sorted(self._summaries.items())
+        for (name, labels), summary in summaries:
+            name = f"{PROMETHEUS_PREFIX}{name}"
+            metric_type(name, "summary")
+            lines.append(f"{name}_count{_prometheus_labels(labels)} {summary.count}")
+            lines.append(f"{name}_sum{_prometheus_labels(labels)} {summary.sum:g}")
+        for (name, labels), summary in summaries:
+            name = f"{PROMETHEUS_PREFIX}{name}_max"
+            metric_type(name, "gauge")
+            lines.append(f"{name}{_prometheus_labels(labels)} {summary.max:g}")
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_path=None, prometheus_path=None):
+        if json_path:
+            _write_atomic(json_path, json.dumps(self.as_dict(), indent=2))
+        if prometheus_path:
+            _write_atomic(prometheus_path, self.prometheus())
+
+
+def _write_atomic(path, content):
+    # Readers polling the file never see a half-written export
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as myfile:
+        myfile.write(content)
+    os.replace(tmp_path, path)
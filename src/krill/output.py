@@ -0,0 +1,150 @@
+import asyncio
+import json
+import re
+import sys
+
+FLUSH_BATCH_SIZE = 100
+SNAPSHOT_BUFFER_SIZE = 1 << 20
+
+_ansi_regex = re.compile(r"(\x1b\[[\d;]*m|\x1b\(B)")  # ANSI color codes
+
+
+def ansi_runs(text):
+    # Splits text once into (is_code, run) pairs so escape sequences can be
+    # written whole while visible characters are typed out one at a time
+    return [
+        (idx % 2 == 1, run) for idx, run in enumerate(_ansi_regex.split(text)) if run
+    ]
+
+
+def merge_spans(spans):
+    # Sorted, non-empty and non-overlapping (start, end) pairs
+    output = []
+    for start, end in sorted(spans or ()):
+        if start >= end:
+            continue
+        if output and start <= output[-1][1]:
+            output[-1] = (output[-1][0], max(output[-1][1], end))
+        else:
+            output.append((start, end))
+    return output
+
+
+def highlight(text, spans, style, text_style=None, decorations=()):
+    # Styles the merged spans of text in a single pass. The rest of the text
+    # keeps the style of any (start, end, style) decoration it falls in, so
+    # e.g. a URL containing a match is styled on both sides of it, and
+    # otherwise gets text_style.
+    plain = text_style or str
+    bounds = sorted(
+        {0, len(text)}
+        | {pos for span in spans for pos in span}
+        | {pos for start, end, _ in decorations for pos in (start, end)}
+    )
+
+    pieces = []
+    span_idx = decoration_idx = 0
+    for start, end in zip(bounds, bounds[1:]):
+        while span_idx < len(spans) and spans[span_idx][1] <= start:
+            span_idx += 1
+        while (
+            decoration_idx < len(decorations)
+            and decorations[decoration_idx][1] <= start
+        ):
+            decoration_idx += 1
+
+        if span_idx < len(spans) and spans[span_idx][0] <= start:
+            pieces.append(style(text[start:end]))
+        elif (
+            decoration_idx < len(decorations)
+            and decorations[decoration_idx][0] <= start
+        ):
+            pieces.append(decorations[decoration_idx][2](text[start:end]))
+        else:
+            pieces.append(plain(text[start:end]))
+    if not pieces:
+        pieces.append(plain(text))
+    return "".join(pieces)
+
+
+def drain(queue, first, limit=FLUSH_BATCH_SIZE):
+    # Collects whatever else is already waiting so it can be written together
+    batch = [first]
+    while len(batch) < limit:
+        try:
+            batch.append(queue.get_nowait())
+        except asyncio.QueueEmpty:
+            break
+    return batch
+
+
+class TerminalRenderer:
+    def __init__(self, stream, delay=None):
+        self.stream = stream
+        # Callable returning the pause before each visible character, or None
+        # to write entries without typewriter pacing
+        self.delay = delay
+
+    async def write(self, entries):
+        if self.delay is None:
+            self.stream.write("".join(f"{entry}\n" for entry in entries))
+            self.stream.flush()
+            return
+
+        for entry in entries:
+            await self.type(entry)
+
+    async def type(self, text):
+        for is_code, run in ansi_runs(text):
+            if is_code:
+                self.stream.write(run)
+                continue
+
+            for char in run:
+                await asyncio.sleep(self.delay())
+                self.stream.write(char)
+                self.stream.flush()
+        self.stream.write("\n")
+        self.stream.flush()
+
+
+def snapshot_record(item):
+    return {
+        "source": item.source,
+        "time": item.time.isoformat() if item.time is not None else None,
+        "title": item.title,
+        "text": item.text,
+        "link": item.link,
+        "guid": item.guid,
+    }
+
+
+class NDJSONWriter:
+    # Writes one json document per line, collecting lines until buffer_size
+    # characters are pending. Without a stream, standard output is used.
+    def __init__(self, stream=None, buffer_size=SNAPSHOT_BUFFER_SIZE):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self._lines = []
+        self._pending = 0
+
+    def write(self, record):
+        line = json.dumps(record) + "\n"
+        self._lines.append(line)
+        self._pending += len(line)
+        if self._pending >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self._lines:
+            return
+        stream = self.stream or sys.stdout
+        stream.write("".join(self._lines))
+        stream.flush()
+        self._lines = []
+        self._pending = 0
+
+    def close(self):
+        self.flush()
+        if self.stream is not None:
+            self.stream.close()
@@ -0,0 +1,198 @@
+import random
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+POLL_MIN_INTERVAL = 60
+POLL_MAX_INTERVAL = 24 * 60 * 60
+# Fraction of the average gap between posts to wait between fetches
+POLL_RATE_FACTOR = 0.5
+# Number of recent item timestamps the posting rate is estimated from
+POLL_HISTORY = 20
+POLL_JITTER = 0.1
+# Sources falling due within this window are fetched together
+POLL_BATCH_WINDOW = 1
+
+SOURCE_OPTIONS = ("interval", "min", "max")
+
+rand = random.SystemRandom()
+
+_ttl_regex = re.compile(rb"<ttl>\s*(\d+)\s*</ttl>", re.IGNORECASE)
+_skip_hours_regex = re.compile(rb"<skipHours>(.*?)</skipHours>", re.IGNORECASE | re.S)
+_skip_days_regex = re.compile(rb"<skipDays>(.*?)</skipDays>", re.IGNORECASE | re.S)
+_hour_regex = re.compile(rb"<hour>\s*(\d+)\s*</hour>", re.IGNORECASE)
+_day_regex = re.compile(rb"<day>\s*(\w+)\s*</day>", re.IGNORECASE)
+_source_option_regex = re.compile(rf"@({'|'.join(SOURCE_OPTIONS)})=(\S*)")
+_max_age_regex = re.compile(r"(?:s-)?max-age\s*=\s*(\d+)", re.IGNORECASE)
+
+DAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+
+def split_source_options(patterns):
+    # Leading "@name=value" tokens on a sources file line configure polling
+    # for that source, e.g. "https://example.com/feed @interval=3600 python".
+    # Any other token, e.g. a filter for the mention "@NASA", ends them.
+    options = dict()
+    tokens = patterns.split(" ") if patterns else []
+    while tokens and (match := _source_option_regex.fullmatch(tokens[0])):
+        tokens.pop(0)
+        name, value = match.groups()
+        try:
+            options[name] = float(value)
+        except ValueError:
+            raise ValueError(f"Invalid source option '@{name}={value}'")
+        if options[name] <= 0:
+            raise ValueError(f"Invalid source option '@{name}={value}'")
+    return options, " ".join(tokens)
+
+
+def feed_hints(data):
+    # RSS <ttl> (minutes) and <skipHours>/<skipDays> (GMT), found with a
+    # plain scan rather than a second parse of the feed
+    hints = dict()
+    if match := _ttl_regex.search(data):
+        hints["ttl"] = int(match.group(1)) * 60
+    if match := _skip_hours_regex.search(data):
+        hints["skip_hours"] = {
+            int(hour) for hour in _hour_regex.findall(match.group(1)) if int(hour) < 24
+        }
+    if match := _skip_days_regex.search(data):
+        hints["skip_days"] = {
+            DAYS.index(day.decode().lower())
+            for day in _day_regex.findall(match.group(1))
+            if day.decode().lower() in DAYS
+        }
+    return hints
+
+
+def cache_lifetime(headers):
+    # Seconds the response may be reused for according to Cache-Control or,
+    # failing that, Expires relative to Date
+    cache_control = headers.get("Cache-Control") or ""
+    if match := _max_age_regex.search(cache_control):
+        return int(match.group(1))
+    if "no-cache" in cache_control or "no-store" in cache_control:
+        return 0
+
+    try:
+        expires = parsedate_to_datetime(headers.get("Expires"))
+        date = (
+            parsedate_to_datetime(headers["Date"])
+            if headers.get("Date")
+            else datetime.now(timezone.utc)
+        )
+    except (TypeError, ValueError, IndexError):
+        return 0
+    if expires.tzinfo is None or date.tzinfo is None:
+        return 0
+    return max((expires - date).total_seconds(), 0)
+
+
+@dataclass
+class SourceSchedule:
+    options: dict = field(default_factory=dict)
+    timestamps: list = field(default_factory=list)
+    hints: dict = field(default_factory=dict)
+    lifetime: float = 0
+    next_due: float = 0
+
+
+class PollingScheduler:
+    # Works out when each source should next be fetched. The interval
+    # follows the source's posting rate, learned from the timestamps of its
+    # items, but never undercuts what the server asks for through caching
+    # headers or <ttl>, and skips the hours and days the feed marks as idle.
+    # Jitter keeps sources from settling back into a single burst.
+    def __init__(
+        self,
+        default_interval,
+        min_interval=POLL_MIN_INTERVAL,
+        max_interval=POLL_MAX_INTERVAL,
+        jitter=POLL_JITTER,
+    ):
+        self.default_interval = default_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self._sources = dict()
+
+    def __contains__(self, source):
+        return source in self._sources
+
+    def add(self, source, options=None, now=None):
+        if source not in self._sources:
+            self._sources[source] = SourceSchedule(
+                next_due=time.time() if now is None else now
+            )
+        self._sources[source].options = dict(options or ())
+
+    def remove(self, source):
+        self._sources.pop(source, None)
+
+    def record_response(self, source, headers, data=None):
+        if (schedule := self._sources.get(source)) is None:
+            return
+        schedule.lifetime = cache_lifetime(headers)
+        if data:
+            schedule.hints = feed_hints(data)
+
+    def record_items(self, source, timestamps):
+        if (schedule := self._sources.get(source)) is None:
+            return
+        seen = set(schedule.timestamps)
+        seen.update(timestamp.timestamp() for timestamp in timestamps if timestamp)
+        schedule.timestamps = sorted(seen)[-POLL_HISTORY:]
+
+    def interval(self, source):
+        schedule = self._sources[source]
+        if "interval" in schedule.options:
+            return schedule.options["interval"]
+
+        timestamps = schedule.timestamps
+        if len(timestamps) > 1:
+            average_gap = (timestamps[-1] - timestamps[0]) / (len(timestamps) - 1)
+            interval = average_gap * POLL_RATE_FACTOR
+        else:
+            interval = self.default_interval
+
+        interval = max(interval, schedule.lifetime, schedule.hints.get("ttl", 0))
+        return min(
+            max(interval, schedule.options.get("min", self.min_interval)),
+            schedule.options.get("max", self.max_interval),
+        )
+
+    def schedule(self, source, now=None):
+        now = time.time() if now is None else now
+        interval = self.interval(source)
+        interval *= rand.uniform(1 - self.jitter, 1 + self.jitter)
+        self._sources[source].next_due = self._skip(source, now + interval)
+        return self._sources[source].next_due
+
+    def _skip(self, source, due):
+        hints = self._sources[source].hints
+        skip_hours = hints.get("skip_hours", ())
+        skip_days = hints.get("skip_days", ())
+
+        # At most a week of hours to step over, in case every hour is skipped
+        for _ in range(7 * 24):
+            when = datetime.fromtimestamp(due, timezone.utc)
+            if when.hour not in skip_hours and when.weekday() not in skip_days:
+                break
+            due = when.replace(minute=0, second=0, microsecond=0).timestamp() + 3600
+        return due
+
+    def next_due(self):
+        return min(
+            (schedule.next_due for schedule in self._sources.values()),
+            default=None,
+        )
+
+    def due(self, now=None):
+        now = time.time() if now is None else now
+        return [
+            source
+            for source, schedule in self._sources.items()
+            if schedule.next_due <= now + POLL_BATCH_WINDOW
+        ]
@@ -0,0 +1,52 @@
+import cProfile
+import os
+import pstats
+import sys
+from contextlib import contextmanager
+
+PROFILE_SORT = "cumulative"
+
+
+class CycleProfiler:
+    # Profiles one update cycle at a time. Each cycle is written to its own
+    # pstats file in the output directory (cycle-0001.pstats, ...) and the
+    # top functions can be printed to stderr after every cycle.
+    def __init__(self, directory=None, top=0, stream=None):
+        self.directory = directory
+        self.top = top
+        self.stream = stream
+        self.cycle_number = 0
+
+    @property
+    def enabled(self):
+        return bool(self.directory or self.top)
+
+    def path(self, cycle_number):
+        return os.path.join(self.directory, f"cycle-{cycle_number:04d}.pstats")
+
+    @contextmanager
+    def cycle(self):
+        if not self.enabled:
+            yield
+            return
+
+        self.cycle_number += 1
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            self._report(profiler)
+
+    def _report(self, profiler):
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            profiler.dump_stats(self.path(self.cycle_number))
+
+        if self.top:
+            stream = self.stream or sys.stderr
+            stream.write(f"Profile of update cycle {self.cycle_number}:\n")
+            stats = pstats.Stats(profiler, stream=stream)
+            stats.sort_stats(PROFILE_SORT).print_stats(self.top)
+            stream.flush()
@@ -0,0 +1,90 @@
+import asyncio
+import time
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class DomainLimit:
+    # Maximum number of requests in flight to the domain at once
+    concurrency: int = 3
+    # Sustained requests per second (None for no rate limit)
+    rate: float = None
+    # Number of requests that may be dispatched back to back
+    burst: int = 1
+
+
+DEFAULT_LIMIT = DomainLimit()
+
+# Keys are matched against the domain as case-insensitive substrings
+DOMAIN_LIMITS = {
+    "reddit": DomainLimit(concurrency=1, rate=1 / 3),
+}
+
+
+def limit_for(domain, limits=None, default=DEFAULT_LIMIT):
+    # The most specific, i.e. longest, key contained in the domain wins, so
+    # that e.g. "old.reddit.com" overrides the built-in "reddit"
+    limits = DOMAIN_LIMITS if limits is None else limits
+    matching = [key for key in limits if key.lower() in domain.lower()]
+    if not matching:
+        return default
+    return limits[max(matching, key=len)]
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        # Waiters are served in FIFO order and each sleeps exactly as long as
+        # it takes for the next token to become available
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class DomainScheduler:
+    def __init__(self, limit=DEFAULT_LIMIT):
+        self.limit = limit
+        self._semaphore = asyncio.Semaphore(limit.concurrency)
+        self._bucket = TokenBucket(limit.rate, limit.burst) if limit.rate else None
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        if self._bucket is not None:
+            try:
+                await self._bucket.acquire()
+            except BaseException:
+                self._semaphore.release()
+                raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._semaphore.release()
+
+
+def parse_domain_limit(spec):
+    # DOMAIN=CONCURRENCY[/RATE], e.g. "reddit=1/0.5"
+    domain, sep, value = spec.partition("=")
+    if not sep or not domain:
+        raise ValueError(f"Invalid domain limit '{spec}'")
+
+    concurrency, _, rate = value.partition("/")
+    limit = DomainLimit(
+        concurrency=int(concurrency), rate=float(rate) if rate else None
+    )
+    if limit.concurrency < 1 or (limit.rate is not None and limit.rate <= 0):
+        raise ValueError(f"Invalid domain limit '{spec}'")
+    return domain, limit
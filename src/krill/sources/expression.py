@@ -5,6 +5,9 @@ class _Expr:
     def build(self):
         return traverse(self, build_expr)
 
+    def build_batch(self):
+        return traverse(self, build_batch_expr)
+
     def __str__(self):
         return traverse(self, print_expr)
 
@@ -24,18 +27,13 @@ class _BinaryExpr(_Expr):
         self.left = left
         self.right = right
 
-    def comparator(self, left, right):
-        raise NotImplementedError
-
 
 class AndExpr(_BinaryExpr):
-    def comparator(self, left, right):
-        return left and right
+    pass
 
 
 class OrExpr(_BinaryExpr):
-    def comparator(self, left, right):
-        return left or right
+    pass
 
 
 class NotExpr(_Expr):
@@ -53,6 +51,11 @@ def build_expr(expr, *funcs):
     raise NotImplementedError
 
 
+@singledispatch
+def build_batch_expr(expr, *funcs):
+    raise NotImplementedError
+
+
 @singledispatch
 def print_expr(expr, *funcs):
     raise NotImplementedError
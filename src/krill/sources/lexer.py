@@ -23,16 +23,15 @@ TOKEN_EXPRS = (
     (r"((?!(&&|\|\||\(|\))).)*(?=($|\n|\(|\)|&&|\|\|))", FILTER),
 )
 
+_TOKEN_REGEXES = tuple((re.compile(pattern), tag) for pattern, tag in TOKEN_EXPRS)
+
 
 def filter_lex(characters):
     pos = 0
     tokens = []
     while pos < len(characters):
         match = None
-        for token_expr in TOKEN_EXPRS:
-            pattern, tag = token_expr
-            regex = re.compile(pattern)
-
+        for regex, tag in _TOKEN_REGEXES:
             if match := regex.match(characters, pos):
                 text = match.group(0).strip()
                 if tag:
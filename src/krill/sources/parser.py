@@ -1,5 +1,6 @@
 # Based on https://www.engr.mun.ca/~theo/Misc/exp_parsing.htm
 import re
+from bisect import bisect_left, bisect_right
 
 from . import lexer
 from .expression import (
@@ -8,6 +9,7 @@ from .expression import (
     NotExpr,
     OrExpr,
     QuotedFilterExpr,
+    build_batch_expr,
     build_expr,
     print_expr,
     traverse,
@@ -35,11 +37,17 @@ def _(expr, func):
 
 @build_expr.register(FilterExpr)
 def _(expr):
-    def func(text):
-        regex = re.compile(expr.filter, re.IGNORECASE)
+    # Compiled once when the filter is built rather than on every call
+    regex = re.compile(expr.filter, re.IGNORECASE)
 
+    def func(text):
+        # Returns the spans of all matches so they can be highlighted without
+        # searching the text again
         if match := regex.search(text):
-            return (True, set([match.group()]))
+            return (
+                True,
+                {found.span() for found in regex.finditer(text, match.start())},
+            )
         else:
             return (False, set())
 
@@ -47,38 +55,271 @@ def _(expr):
 
 
 @build_expr.register(AndExpr)
-@build_expr.register(OrExpr)
 def _(expr, left, right):
-    def func(text):
+    def and_func(text):
         left_output = left(text)
+        if not left_output[0]:
+            return (False, set())
+
         right_output = right(text)
+        if not right_output[0]:
+            return (False, set())
 
-        if output := expr.comparator(left_output[0], right_output[0]):
-            matches = set()
-            if left_output[1]:
-                matches.update(left_output[1])
+        return (True, left_output[1] | right_output[1])
 
-            if right_output[1]:
-                matches.update(right_output[1])
+    return and_func
 
-            return (output, matches)
-        return False, set()
 
-    return func
+@build_expr.register(OrExpr)
+def _(expr, left, right):
+    def or_func(text):
+        left_output = left(text)
+        if left_output[0]:
+            return left_output
+
+        right_output = right(text)
+        if right_output[0]:
+            return right_output
+
+        return (False, set())
+
+    return or_func
 
 
 @build_expr.register(NotExpr)
 def _(expr, inner):
     def not_func(text):
-        inner_output = inner(text)
-        if inner_output[0]:
-            return (False, inner_output[1])
+        if inner(text)[0]:
+            return (False, set())
         else:
-            return (True, inner_output[1])
+            return (True, set())
+
+    return not_func
+
+
+# Texts in a batch are joined with a character that \b, \s and friends
+# treat like the start or end of a string
+BATCH_SEPARATOR = "\n"
+# A regex scans the whole buffer only when at least 1/BATCH_MIN_SHARE of the
+# batch is still undecided; fewer texts are searched one by one
+BATCH_MIN_SHARE = 4
+
+# Patterns whose meaning depends on where the string starts or ends, or on
+# what surrounds a match, are run against each text on its own instead
+_anchored_regex = re.compile(r"\^|\$|\\[AZ]|\(\?<?[=!]")
+
+
+def iter_bits(bits):
+    # Indices of the set bits, lowest first
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+class TextBatch:
+    # One field (e.g. the titles) of many items joined into a single buffer,
+    # so each regex scans all of them in one go. Items missing the field are
+    # left out and never match, not even a negated filter.
+    def __init__(self, texts):
+        self.texts = texts
+        self.present = 0
+        # Buffer offset and item index of each text that is present
+        self.starts = []
+        self.indices = []
+
+        parts = []
+        pos = 0
+        for index, text in enumerate(texts):
+            if text is None:
+                continue
+            self.present |= 1 << index
+            self.starts.append(pos)
+            self.indices.append(index)
+            parts.append(text)
+            pos += len(text) + len(BATCH_SEPARATOR)
+        self.buffer = BATCH_SEPARATOR.join(parts)
+
+
+# Batch filters take a TextBatch and a bitset of the items still in question,
+# and return (bits, spans): the matching items among those as an int bitset,
+# and the match spans by item index, relative to that item's own text. Like
+# the single text filters, AND and OR only look at the right side for the
+# items the left side leaves undecided.
+@build_batch_expr.register(FilterExpr)
+def _(expr):
+    regex = re.compile(expr.filter, re.IGNORECASE)
+    anchored = _anchored_regex.search(expr.filter) is not None
+
+    def search_each(batch, positions):
+        bits = 0
+        spans = dict()
+        for pos in positions:
+            index = batch.indices[pos]
+            text = batch.texts[index]
+            if match := regex.search(text):
+                bits |= 1 << index
+                spans[index] = {
+                    found.span() for found in regex.finditer(text, match.start())
+                }
+        return bits, spans
+
+    def batch_func(batch, mask=None):
+        mask = batch.present if mask is None else mask & batch.present
+        if not mask:
+            return (0, dict())
+        if anchored or mask.bit_count() * BATCH_MIN_SHARE < len(batch.indices):
+            # Scanning the whole buffer would mostly be wasted
+            return search_each(
+                batch,
+                [bisect_left(batch.indices, index) for index in iter_bits(mask)],
+            )
+
+        bits = 0
+        spans = dict()
+        # Texts with a match running into the next text, which may have
+        # hidden other matches; they are searched again on their own
+        retry = set()
+        for match in regex.finditer(batch.buffer):
+            start, end = match.span()
+            pos = bisect_right(batch.starts, start) - 1
+            offset = batch.starts[pos]
+            index = batch.indices[pos]
+            text_end = offset + len(batch.texts[index])
+            if end > text_end:
+                # A match starting on the separator itself takes nothing
+                # from the text before it
+                first = pos + 1 if start == text_end else pos
+                last = bisect_right(batch.starts, end - 1) - 1
+                retry.update(range(first, last + 1))
+                continue
+
+            if mask >> index & 1:
+                bits |= 1 << index
+                spans.setdefault(index, set()).add((start - offset, end - offset))
+
+        retry = [pos for pos in sorted(retry) if mask >> batch.indices[pos] & 1]
+        if retry:
+            for pos in retry:
+                index = batch.indices[pos]
+                bits &= ~(1 << index)
+                spans.pop(index, None)
+            retry_bits, retry_spans = search_each(batch, retry)
+            bits |= retry_bits
+            spans.update(retry_spans)
+        return bits, spans
+
+    return batch_func
+
+
+@build_batch_expr.register(AndExpr)
+def _(expr, left, right):
+    def and_func(batch, mask=None):
+        left_bits, left_spans = left(batch, mask)
+        if not left_bits:
+            return (0, dict())
+
+        right_bits, right_spans = right(batch, left_bits)
+        return (
+            right_bits,
+            {
+                index: left_spans.get(index, set()) | right_spans.get(index, set())
+                for index in iter_bits(right_bits)
+            },
+        )
+
+    return and_func
+
+
+@build_batch_expr.register(OrExpr)
+def _(expr, left, right):
+    def or_func(batch, mask=None):
+        mask = batch.present if mask is None else mask & batch.present
+        left_bits, spans = left(batch, mask)
+        if left_bits == mask:
+            return (left_bits, spans)
+
+        right_bits, right_spans = right(batch, mask & ~left_bits)
+        spans.update(right_spans)
+        return (left_bits | right_bits, spans)
+
+    return or_func
+
+
+@build_batch_expr.register(NotExpr)
+def _(expr, inner):
+    def not_func(batch, mask=None):
+        mask = batch.present if mask is None else mask & batch.present
+        inner_bits, _ = inner(batch, mask)
+        return (mask & ~inner_bits, dict())
 
     return not_func
 
 
+class CompiledFilter:
+    # A filter built both for single texts, by calling it, and for batches
+    # of texts through match_batch
+    def __init__(self, expr):
+        self.match = expr.build()
+        self.match_batch = expr.build_batch()
+
+    def __call__(self, text):
+        return self.match(text)
+
+
+def first_matches(re_funcs, batches):
+    # Runs the compiled filters in order over batches of the same items, by
+    # field name. An item is only checked until a filter matches one of its
+    # fields, and that filter's spans are the item's. Yields, for each filter
+    # run, its position, the items it checked and matched as bitsets, and the
+    # spans by field of each item it matched.
+    count = max((len(batch.texts) for batch in batches.values()), default=0)
+    remaining = (1 << count) - 1
+    for position, re_func in enumerate(re_funcs):
+        if not remaining:
+            break
+        results = {
+            name: re_func.match_batch(batch, remaining)
+            for name, batch in batches.items()
+        }
+        hits = 0
+        for bits, _ in results.values():
+            hits |= bits
+        yield position, remaining, hits, {
+            index: {
+                name: spans.get(index, set()) for name, (_, spans) in results.items()
+            }
+            for index in iter_bits(hits)
+        }
+        remaining &= ~hits
+
+
+# Filters compiled by a filter worker process, by filter string, kept for
+# the life of the process
+_worker_filters = dict()
+
+
+# Entry point for filter worker processes, which get one shard of the
+# filters and the texts of a batch of items by field. Only the outcome goes
+# back: the checks and hits of each filter run, and for each matched item
+# the position of the filter that matched it along with its spans.
+def match_filters(filter_strings, texts):
+    re_funcs = []
+    for filter_string in filter_strings:
+        if filter_string not in _worker_filters:
+            _worker_filters[filter_string] = compile_filter(filter_string)
+        re_funcs.append(_worker_filters[filter_string])
+
+    batches = {name: TextBatch(field_texts) for name, field_texts in texts.items()}
+    counts = []
+    matched = dict()
+    for position, checked, hits, spans in first_matches(re_funcs, batches):
+        counts.append((position, checked.bit_count(), hits.bit_count()))
+        for index, item_spans in spans.items():
+            matched[index] = (position, item_spans)
+    return counts, matched
+
+
 @print_expr.register(FilterExpr)
 def _(expr):
     return f"{expr.__class__.__name__}({expr.filter})"
@@ -156,3 +397,13 @@ class TokenParser:
 
     def build(self):
         return self.E().build()
+
+    def build_batch(self):
+        return self.E().build_batch()
+
+    def compile(self):
+        return CompiledFilter(self.E())
+
+
+def compile_filter(filter_string):
+    return TokenParser(lexer.filter_lex(filter_string)).compile()
@@ -0,0 +1,260 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from .utils import FILTER_LAST_DAYS
+
+BLOOM_BITS = 1 << 23
+BLOOM_HASHES = 7
+# Share of the keys in a Bloom filter that may be evicted before it is rebuilt
+BLOOM_REBUILD_FRACTION = 0.25
+MAX_SEEN_ITEMS = 500_000
+MAX_STORED_ITEMS = 100_000
+
+
+class BloomFilter:
+    def __init__(self, bits=BLOOM_BITS, hashes=BLOOM_HASHES):
+        self.bits = bits
+        self.hashes = hashes
+        self._array = bytearray((bits + 7) // 8)
+
+    def _positions(self, key):
+        # Double hashing: derive all probe positions from one digest
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self._array[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(
+            self._array[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key)
+        )
+
+    def clear(self):
+        self._array = bytearray(len(self._array))
+
+
+class SeenStore:
+    # Keys of items that have already been printed, kept in SQLite so that
+    # they survive restarts. A fixed-size Bloom filter answers the common
+    # "never seen" case without touching the database. Entries expire once
+    # they have not been seen for FILTER_LAST_DAYS, after which the item
+    # would be too old to print anyway.
+    #
+    # Hashing every key of a large store takes seconds, so a store on disk
+    # starts without a filter and answers from SQLite until rebuild_bloom,
+    # which is safe to run in another thread, has built one. Evicted keys
+    # stay in the filter, costing only false positives, until they make up
+    # BLOOM_REBUILD_FRACTION of it.
+    def __init__(
+        self,
+        path=":memory:",
+        ttl=FILTER_LAST_DAYS * 24 * 60 * 60,
+        max_items=MAX_SEEN_ITEMS,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_items = max_items
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS seen (key TEXT PRIMARY KEY, seen_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS seen_at_idx ON seen (seen_at)")
+        self._bloom = None
+        # Keys in the filter, and how many of them have since been evicted
+        self._bloom_keys = 0
+        self._stale = 0
+        # Keys added since the last commit, and while a new filter is being
+        # built, which the build might not read from the database
+        self._added = []
+        self._rebuilding = False
+        self._lock = threading.Lock()
+        # Keys seen again since the last commit, refreshed in one go
+        self._refreshed = set()
+        if path == ":memory:":
+            self.rebuild_bloom()
+
+    @property
+    def needs_rebuild(self):
+        return (
+            self._bloom is None
+            or self._stale > self._bloom_keys * BLOOM_REBUILD_FRACTION
+        )
+
+    def rebuild_bloom(self):
+        # Reads the committed keys through a connection of its own, so that
+        # it can run in a worker thread, then swaps in the new filter
+        with self._lock:
+            self._rebuilding = True
+        db = self._db if self.path == ":memory:" else sqlite3.connect(self.path)
+        try:
+            keys = db.execute("SELECT key FROM seen").fetchall()
+        except Exception:
+            with self._lock:
+                self._rebuilding = False
+            raise
+        finally:
+            if db is not self._db:
+                db.close()
+
+        bloom = BloomFilter()
+        for (key,) in keys:
+            bloom.add(key)
+        with self._lock:
+            for key in self._added:
+                bloom.add(key)
+            self._bloom = bloom
+            self._bloom_keys = len(keys) + len(self._added)
+            self._stale = 0
+            self._rebuilding = False
+
+    def __contains__(self, key):
+        if self._bloom is not None and key not in self._bloom:
+            return False
+
+        found = self._db.execute("SELECT 1 FROM seen WHERE key = ?", (key,)).fetchone()
+        if found is None:
+            return False
+        # Refreshed so items still present in a feed are not evicted
+        self._refreshed.add(key)
+        return True
+
+    def add(self, key):
+        self._db.execute(
+            "INSERT OR REPLACE INTO seen (key, seen_at) VALUES (?, ?)",
+            (key, time.time()),
+        )
+        self._refreshed.discard(key)
+        with self._lock:
+            self._added.append(key)
+            if self._bloom is not None:
+                self._bloom.add(key)
+                self._bloom_keys += 1
+
+    def _refresh(self):
+        if self._refreshed:
+            now = time.time()
+            self._db.executemany(
+                "UPDATE seen SET seen_at = ? WHERE key = ?",
+                ((now, key) for key in self._refreshed),
+            )
+            self._refreshed.clear()
+
+    def keys(self, prefix=""):
+        # Range scan on the primary key, e.g. all item ids of one source
+        return frozenset(
+            key
+            for (key,) in self._db.execute(
+                "SELECT key FROM seen WHERE key >= ? AND key < ?",
+                (prefix, prefix + "\U0010ffff"),
+            )
+        )
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM seen").fetchone()[0]
+
+    def evict(self):
+        self._refresh()
+        removed = self._db.execute(
+            "DELETE FROM seen WHERE seen_at < ?", (time.time() - self.ttl,)
+        ).rowcount
+
+        excess = len(self) - self.max_items
+        if excess > 0:
+            removed += self._db.execute(
+                "DELETE FROM seen WHERE key IN "
+                "(SELECT key FROM seen ORDER BY seen_at LIMIT ?)",
+                (excess,),
+            ).rowcount
+
+        # Bloom filters cannot forget keys; see needs_rebuild
+        self._stale += removed
+        return removed
+
+    def commit(self):
+        self._refresh()
+        self._db.commit()
+        with self._lock:
+            if not self._rebuilding:
+                self._added.clear()
+
+    def close(self):
+        self.commit()
+        self._db.close()
+
+
+class ItemStore:
+    # Items collected by the daemon, kept so that queries can be answered
+    # without fetching anything. Each item's snapshot record is serialised
+    # once on the way in and handed out as is.
+    def __init__(
+        self,
+        path=":memory:",
+        ttl=FILTER_LAST_DAYS * 24 * 60 * 60,
+        max_items=MAX_STORED_ITEMS,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_items = max_items
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS items (key TEXT PRIMARY KEY, "
+            "stored_at REAL NOT NULL, title TEXT, text TEXT, link TEXT, "
+            "record TEXT NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS stored_at_idx ON items (stored_at)"
+        )
+
+    def add(self, key, record):
+        self._db.execute(
+            "INSERT OR REPLACE INTO items "
+            "(key, stored_at, title, text, link, record) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                time.time(),
+                record["title"],
+                record["text"],
+                record["link"],
+                json.dumps(record),
+            ),
+        )
+
+    def items(self, since=None):
+        # (title, text, link, record) of the items stored after since, newest
+        # first
+        return self._db.execute(
+            "SELECT title, text, link, record FROM items WHERE stored_at > ? "
+            "ORDER BY stored_at DESC",
+            (since or 0,),
+        )
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+    def evict(self):
+        removed = self._db.execute(
+            "DELETE FROM items WHERE stored_at < ?", (time.time() - self.ttl,)
+        ).rowcount
+
+        excess = len(self) - self.max_items
+        if excess > 0:
+            removed += self._db.execute(
+                "DELETE FROM items WHERE key IN "
+                "(SELECT key FROM items ORDER BY stored_at LIMIT ?)",
+                (excess,),
+            ).rowcount
+        return removed
+
+    def commit(self):
+        self._db.commit()
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
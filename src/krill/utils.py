@@ -1,4 +1,5 @@
 import asyncio
+import os
 import random
 import sys
 from contextlib import contextmanager
@@ -12,8 +13,9 @@ class RandomQueue(asyncio.PriorityQueue):
         priority = random.random()
         super().put_nowait((priority, item))
 
-    async def get(self):
-        priority, item = await super().get()
+    # Queue.get() is implemented in terms of get_nowait()
+    def get_nowait(self):
+        priority, item = super().get_nowait()
         return item
 
 
@@ -34,8 +36,8 @@ def get_time_logger(debug):
         start = datetime.now()
 
         if debug:
-            sys.stdout.write(f"Start {msg}\n")
-            sys.stdout.flush()
+            sys.stderr.write(f"Start {msg}\n")
+            sys.stderr.flush()
 
         try:
             yield
@@ -44,7 +46,14 @@ def get_time_logger(debug):
         finally:
             finish = datetime.now()
             if debug:
-                sys.stdout.write(f"Finish {msg} in {finish - start}\n")
-                sys.stdout.flush()
+                sys.stderr.write(f"Finish {msg} in {finish - start}\n")
+                sys.stderr.flush()
 
     return time_log
+
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "krill")
@@ -0,0 +1,46 @@
+from datetime import datetime, timezone
+
+import pytest
+from dateutil import parser as dt_parser
+
+from krill.feed import dates
+from krill.feed.dates import parse_date
+
+
+@pytest.fixture(autouse=True)
+def reset_cache():
+    dates._parse_date.cache_clear()
+    dates.DATE_PARSE_STATS.clear()
+
+
+class TestParseDate:
+    @pytest.mark.parametrize(
+        "date_str, parser",
+        [
+            ("Tue, 02 Jan 2024 03:04:05 GMT", "rfc822"),
+            ("Tue, 02 Jan 2024 03:04:05 +0100", "rfc822"),
+            ("2024-01-02T03:04:05Z", "iso8601"),
+            ("2024-01-02T03:04:05.123456+01:00", "iso8601"),
+            ("2024-01-02", "iso8601"),
+            ("January 2, 2024 3:04am UTC", "fallback"),
+        ],
+    )
+    def test_matches_dateutil(self, date_str, parser):
+        assert parse_date(date_str) == dt_parser.parse(date_str)
+        assert dates.DATE_PARSE_STATS == {parser: 1}
+
+    def test_named_zone(self):
+        assert parse_date("02 Jan 2024 03:04:05 EST") == datetime(
+            2024, 1, 2, 8, 4, 5, tzinfo=timezone.utc
+        )
+
+    def test_unknown_zone_is_utc(self):
+        assert parse_date("Tue, 02 Jan 2024 03:04:05 -0000") == datetime(
+            2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc
+        )
+
+    def test_cached(self):
+        for _ in range(3):
+            parse_date(" 2024-01-02T03:04:05Z ")
+
+        assert dates.date_parse_stats() == {"iso8601": 1, "cached": 2}
@@ -0,0 +1,57 @@
+from datetime import datetime
+
+import pytest
+
+from krill.feed.fingerprint import canonical_link, dedup_keys, fingerprint
+from krill.feed.parser import StreamItem
+
+
+def _item(title=None, text=None, link=None, source="example.com"):
+    return StreamItem(source, datetime.now(), title, text, link)
+
+
+class TestCanonicalLink:
+    @pytest.mark.parametrize(
+        "link",
+        [
+            "https://www.example.com/story/",
+            "http://example.com/story",
+            "https://example.com:443/story#comments",
+            "https://example.com/story?utm_source=rss&utm_medium=feed",
+            "https://EXAMPLE.com/story?fbclid=abc",
+        ],
+    )
+    def test_equivalent_links(self, link):
+        assert canonical_link(link) == "example.com/story"
+
+    def test_keeps_meaningful_query(self):
+        assert (
+            canonical_link("https://example.com/item?utm_source=x&id=1&b=2")
+            == "example.com/item?b=2&id=1"
+        )
+
+    def test_keeps_non_default_port(self):
+        assert canonical_link("http://example.com:8080/a") == "example.com:8080/a"
+
+    def test_empty(self):
+        assert canonical_link(None) is None
+
+
+class TestFingerprint:
+    def test_normalised_title(self):
+        assert fingerprint(_item(title="Python 3.14 is released!")) == fingerprint(
+            _item(title="python 3 14 IS released", source="reddit.com")
+        )
+
+    def test_short_title_ignored(self):
+        assert fingerprint(_item(title="Weekly thread")) is None
+
+    def test_text_without_title(self):
+        assert fingerprint(_item(text="a tweet with enough words in it"))
+
+    def test_dedup_keys(self):
+        item = _item(title="Python 3.14 is released", link="https://example.com/a/")
+        keys = dedup_keys(item)
+
+        assert keys[0] == "link:example.com/a"
+        assert keys[1].startswith("fp:")
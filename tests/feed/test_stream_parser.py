@@ -0,0 +1,184 @@
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import pytest
+
+from krill.feed import parser
+from krill.feed.parser import (
+    LazyStreamItem,
+    StreamItem,
+    StreamParser,
+    TextExcerpter,
+    entry_id,
+    parse_items,
+    unpack_items,
+)
+
+pytest_plugins = ("pytest_asyncio",)
+
+URL = "http://example.com/rss"
+
+
+def _date(hours_ago=1):
+    date = datetime.now(timezone.utc) - timedelta(hours=hours_ago)
+    return date.strftime("%a, %d %b %Y %H:%M:%S %z")
+
+
+RSS_FEED = f"""<?xml version="1.0"?>
+<rss version="2.0"><channel><title>Test</title>
+<item>
+  <title>Python news</title>
+  <link>http://example.com/python</link>
+  <description>&lt;p&gt;All about &lt;b&gt;python&lt;/b&gt;&lt;/p&gt;</description>
+  <pubDate>{_date()}</pubDate>
+</item>
+<item>
+  <title>Old news</title>
+  <link>http://example.com/old</link>
+  <description>Ancient history</description>
+  <pubDate>{_date(24 * 365)}</pubDate>
+</item>
+</channel></rss>
+""".encode()
+
+
+ATOM_FEED = f"""<?xml version="1.0"?>
+<feed xmlns="http://www.w3.org/2005/Atom"><title>Test</title>
+<entry>
+  <title>Vim tips</title>
+  <link rel="alternate" href="http://example.org/vim"/>
+  <id>urn:vim</id>
+  <published>{datetime.now(timezone.utc).isoformat()}</published>
+  <summary>Editing fast</summary>
+</entry>
+</feed>
+""".encode()
+
+# The undefined entity makes this invalid XML for the streaming parser
+MALFORMED_FEED = RSS_FEED.replace(b"All about", b"All&nbsp;about")
+
+
+async def _items(data, url=URL, seen=None):
+    return [item async for item in StreamParser.get_items(data, url, seen)]
+
+
+@pytest.mark.asyncio
+class TestGetFeedItems:
+    async def test_rss(self):
+        (item,) = await _items(RSS_FEED)
+
+        assert item.source == "example.com"
+        assert item.title == "Python news"
+        assert item.text == "All about python"
+        assert item.link == "http://example.com/python"
+
+    async def test_atom_link_from_href(self):
+        (item,) = await _items(ATOM_FEED)
+
+        assert item.title == "Vim tips"
+        assert item.link == "http://example.org/vim"
+
+    async def test_small_chunks(self):
+        expected = await _items(RSS_FEED)
+        with mock.patch("krill.feed.parser.FEED_CHUNK_SIZE", 16):
+            assert await _items(RSS_FEED) == expected
+
+    async def test_malformed_feed_falls_back(self):
+        (item,) = await _items(MALFORMED_FEED)
+
+        assert item.title == "Python news"
+
+    async def test_no_entries(self):
+        with pytest.raises(Exception, match="Failed to find entries"):
+            await _items(b"<html><body>Not a feed</body></html>")
+
+    async def test_text_converted_lazily(self):
+        with mock.patch.object(
+            parser, "html_to_text", wraps=parser.html_to_text
+        ) as mock_html_to_text:
+            (item,) = await _items(RSS_FEED)
+            # Neither the new item nor the too-old one has been converted yet
+            mock_html_to_text.assert_not_called()
+
+            assert item.text == "All about python"
+            assert item.text == "All about python"
+            mock_html_to_text.assert_called_once()
+
+    async def test_guid(self):
+        (item,) = await _items(RSS_FEED.replace(b"<item>", b"<item><guid>g1</guid>", 1))
+        assert item.guid == "g1"
+
+        (item,) = await _items(ATOM_FEED)
+        assert item.guid == "urn:vim"
+
+    async def test_seen_entries_are_dropped_early(self):
+        seen = mock.Mock(side_effect=lambda key: key == "example.com\turn:vim")
+        with mock.patch.object(
+            parser, "parse_date", wraps=parser.parse_date
+        ) as mock_parse_date:
+            assert await _items(ATOM_FEED, seen=seen) == []
+            mock_parse_date.assert_not_called()
+
+        (item,) = await _items(RSS_FEED, seen=seen)
+        seen.assert_any_call("example.com\thttp://example.com/python")
+
+
+class TestLazyStreamItem:
+    def test_assign_text(self):
+        item = LazyStreamItem("example.com", None, "Title", "<p>html</p>", None)
+        item.text = "plain"
+        assert item.text == "plain"
+
+
+class TestParseItems:
+    def test_round_trip(self):
+        (item,) = unpack_items(parse_items(RSS_FEED, URL))
+
+        assert isinstance(item, StreamItem)
+        assert item.title == "Python news"
+        assert item.link == "http://example.com/python"
+
+    def test_known_entries_are_skipped(self):
+        known = frozenset([entry_id("example.com", None, "http://example.com/python")])
+        assert parse_items(RSS_FEED, URL, known) == []
+
+
+@pytest.mark.asyncio
+class TestTextExcerpter:
+    async def test_short_text(self):
+        assert await TextExcerpter.get_excerpt("python", 10, [(0, 6)]) == (
+            "python",
+            False,
+            False,
+            [(0, 6)],
+        )
+
+    async def test_excerpt_around_match(self):
+        text = "one two three four python five six seven eight"
+        excerpt, clipped_left, clipped_right, spans = await TextExcerpter.get_excerpt(
+            text, 20, [(19, 25)]
+        )
+
+        assert (clipped_left, clipped_right) == (True, True)
+        assert "python" in excerpt
+        ((start, end),) = spans
+        assert excerpt[start:end] == "python"
+
+    async def test_following_matches_that_fit(self):
+        text = "python " + "x " * 5 + "python " + "y " * 50 + "python"
+        excerpt, _, _, spans = await TextExcerpter.get_excerpt(
+            text, 40, [(0, 6), (17, 23), (len(text) - 6, len(text))]
+        )
+
+        assert [excerpt[start:end] for start, end in spans] == ["python", "python"]
+
+    async def test_no_match(self):
+        excerpt, clipped_left, clipped_right, spans = await TextExcerpter.get_excerpt(
+            "one two three four", 10
+        )
+        assert (excerpt, clipped_left, clipped_right, spans) == (
+            "one two",
+            False,
+            True,
+            [],
+        )
@@ -0,0 +1,135 @@
+# Local stand-in for the Hacker News Firebase API, serving the endpoints
+# krill uses from an in-memory item table. Run it directly to point a real
+# krill process at it:
+#
+#   python -m tests.hn_server 8000 &
+#   KRILL_HN_API=http://127.0.0.1:8000/v0 krill -s hackernews --hn-incremental
+import json
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_item_regex = re.compile(r"^/v0/item/(\d+)\.json$")
+
+
+class Unavailable(Exception):
+    pass
+
+
+class FakeHackerNews:
+    def __init__(self, host="127.0.0.1", port=0):
+        self.items = dict()
+        self.requests = []
+        # Paths answered with a server error the next time they are requested
+        self.failing = set()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v0"
+
+    def add_story(self, title=None, url=None, by="pg", **fields):
+        with self._lock:
+            item_id = max(self.items, default=0) + 1
+            self.items[item_id] = {
+                "id": item_id,
+                "type": "story",
+                "by": by,
+                "time": int(time.time()),
+                "title": title or f"Story {item_id}",
+                "url": url or f"http://example.com/{item_id}",
+                **fields,
+            }
+        return item_id
+
+    def add_comment(self, parent, text="A comment"):
+        with self._lock:
+            item_id = max(self.items, default=0) + 1
+            self.items[item_id] = {
+                "id": item_id,
+                "type": "comment",
+                "by": "pg",
+                "time": int(time.time()),
+                "parent": parent,
+                "text": text,
+            }
+        return item_id
+
+    def _stories(self):
+        return sorted(
+            (
+                item_id
+                for item_id, item in self.items.items()
+                if item["type"] == "story"
+            ),
+            reverse=True,
+        )
+
+    def respond(self, path):
+        with self._lock:
+            self.requests.append(path)
+            if path in self.failing:
+                self.failing.discard(path)
+                raise Unavailable(path)
+            if path == "/v0/maxitem.json":
+                return max(self.items, default=0)
+            if path in ("/v0/topstories.json", "/v0/newstories.json"):
+                return self._stories()[:500]
+            if match := _item_regex.match(path):
+                return self.items.get(int(match.group(1)))
+        raise KeyError(path)
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                try:
+                    body = json.dumps(api.respond(self.path)).encode()
+                    self.send_response(200)
+                except KeyError:
+                    body = b'{"error": "Permission denied"}'
+                    self.send_response(401)
+                except Unavailable:
+                    body = b'{"error": "Unavailable"}'
+                    self.send_response(503)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    api = FakeHackerNews(port=port)
+    for _ in range(30):
+        api.add_story()
+    print(f"Serving {api.url}")
+    api.start()._thread.join()
@@ -1,5 +1,7 @@
+from unittest import mock
+
 from krill.sources.lexer import filter_lex
-from krill.sources.parser import TokenParser
+from krill.sources.parser import TextBatch, TokenParser, iter_bits, match_filters
 
 
 class TestParser:
@@ -198,3 +200,93 @@ class TestParser:
         expected = "OrExpr(AndExpr(FilterExpr(a), OrExpr(FilterExpr(b), AndExpr(FilterExpr(c), FilterExpr(d)))), QuotedFilterExpr((e)))"
         actual = str(TokenParser(tokens).E())
         assert expected == actual
+
+
+class TestBuiltFilter:
+    def test_AND_collects_both_matches(self):
+        test_func = TokenParser(filter_lex("python && fun")).build()
+        assert test_func("Python is fun") == (True, {(0, 6), (10, 13)})
+
+    def test_AND_short_circuits(self):
+        test_func = TokenParser(filter_lex("rust && fun")).build()
+        assert test_func("python is fun") == (False, set())
+
+    def test_OR_short_circuits(self):
+        test_func = TokenParser(filter_lex("python || fun")).build()
+        assert test_func("python is fun") == (True, {(0, 6)})
+
+    def test_spans_of_every_occurrence(self):
+        test_func = TokenParser(filter_lex("c\\+\\+")).build()
+        assert test_func("c++ or C++?") == (True, {(0, 3), (7, 10)})
+
+    def test_NOT_has_no_matches(self):
+        test_func = TokenParser(filter_lex("!rust")).build()
+        assert test_func("python is fun") == (True, set())
+
+        test_func = TokenParser(filter_lex("!python")).build()
+        assert test_func("python is fun") == (False, set())
+
+    def test_regex_compiled_once(self):
+        test_func = TokenParser(filter_lex("python && (fun || simple)")).build()
+        with mock.patch("krill.sources.parser.re.compile") as mock_compile:
+            for _ in range(3):
+                assert test_func("python is simple")[0]
+        mock_compile.assert_not_called()
+
+
+class TestBatchFilter:
+    def check(self, filter_string, texts):
+        compiled = TokenParser(filter_lex(filter_string)).compile()
+        bits, spans = compiled.match_batch(TextBatch(texts))
+        for index, text in enumerate(texts):
+            expected = (False, set()) if text is None else compiled(text)
+            assert bool(bits >> index & 1) == expected[0], (index, text)
+            assert spans.get(index, set()) == expected[1], (index, text)
+        return list(iter_bits(bits))
+
+    def test_same_as_single_texts(self):
+        texts = ["python is fun", "rust", "Python && more python", "go"]
+        assert self.check("python", texts) == [0, 2]
+        assert self.check("python && fun", texts) == [0]
+        assert self.check("rust || fun", texts) == [0, 1]
+        assert self.check("python && !fun", texts) == [2]
+
+    def test_missing_texts_never_match(self):
+        assert self.check("!python", ["rust", None, "python"]) == [0]
+
+    def test_matches_across_texts_are_searched_again(self):
+        texts = ["a python", "python b", "c"]
+        assert self.check("python\\s+python", texts) == []
+        assert self.check("python\\s*", texts) == [0, 1]
+        assert self.check("\\s", ["a", "", "b c"]) == [2]
+
+    def test_anchored_patterns(self):
+        texts = ["python rocks", "i like python"]
+        assert self.check("^python", texts) == [0]
+        assert self.check("python$", texts) == [1]
+
+    def test_empty_batch(self):
+        assert self.check("python", []) == []
+        assert self.check("!python", [None]) == []
+
+
+class TestMatchFilters:
+    def test_first_filter_to_match_wins(self):
+        texts = {
+            "title": ["python is fun", "rust", None],
+            "link": ["http://a", "http://rust", "http://go"],
+        }
+        counts, matched = match_filters(["fun", "python", "rust"], texts)
+
+        assert counts == [(0, 3, 1), (1, 2, 0), (2, 2, 1)]
+        assert matched == {
+            0: (0, {"title": {(10, 13)}, "link": set()}),
+            1: (2, {"title": {(0, 4)}, "link": {(7, 11)}}),
+        }
+
+    def test_filters_compiled_once(self):
+        texts = {"title": ["python"]}
+        match_filters(["python"], texts)
+        with mock.patch("krill.sources.parser.TokenParser") as mock_parser:
+            assert match_filters(["python"], texts)[1]
+        mock_parser.assert_not_called()
@@ -0,0 +1,49 @@
+from krill.cache import ValidatorCache
+
+
+class TestValidatorCache:
+    def test_no_headers_for_unknown_url(self):
+        cache = ValidatorCache()
+        assert cache.headers("http://example.com/rss") == {}
+
+    def test_conditional_headers(self):
+        cache = ValidatorCache()
+        cache.update(
+            "http://example.com/rss",
+            {"ETag": '"abc"', "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"},
+        )
+        assert cache.headers("http://example.com/rss") == {
+            "If-None-Match": '"abc"',
+            "If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT",
+        }
+
+    def test_validators_dropped_when_missing(self):
+        cache = ValidatorCache()
+        cache.update("http://example.com/rss", {"ETag": '"abc"'})
+        cache.update("http://example.com/rss", {})
+        assert cache.headers("http://example.com/rss") == {}
+
+    def test_survives_restart(self, tmp_path):
+        path = str(tmp_path / "krill" / "validators.json")
+        cache = ValidatorCache(path).load()
+        cache.update("http://example.com/rss", {"ETag": '"abc"'})
+        cache.save()
+
+        reloaded = ValidatorCache(path).load()
+        assert reloaded.headers("http://example.com/rss") == {"If-None-Match": '"abc"'}
+
+    def test_corrupt_file_ignored(self, tmp_path):
+        path = tmp_path / "validators.json"
+        path.write_text("{not json")
+        cache = ValidatorCache(str(path)).load()
+        assert cache.headers("http://example.com/rss") == {}
+
+    def test_key_must_match(self):
+        cache = ValidatorCache()
+        cache.update("http://example.com/rss", {"ETag": '"abc"'}, key="python")
+
+        assert cache.headers("http://example.com/rss", "python") == {
+            "If-None-Match": '"abc"'
+        }
+        assert cache.headers("http://example.com/rss", "rust") == {}
+        assert cache.headers("http://example.com/rss") == {}
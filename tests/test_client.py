@@ -0,0 +1,56 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from krill.client import ClientPool
+
+pytest_plugins = ("pytest_asyncio",)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.asyncio
+class TestClientPool:
+    async def test_client_per_domain(self):
+        pool = ClientPool()
+        try:
+            assert pool.client("example.com") is pool.client("example.com")
+            assert pool.client("example.com") is not pool.client("example.org")
+        finally:
+            await pool.aclose()
+
+    async def test_connections_reused(self, server_url):
+        pool = ClientPool()
+        try:
+            for _ in range(3):
+                resp = await pool.get(f"{server_url}/feed")
+                assert resp.content == b"ok"
+        finally:
+            await pool.aclose()
+
+        (stats,) = pool.stats().values()
+        assert stats == {"requests": 3, "connections": 1, "reused": 2}
+        assert pool.reuse_ratio() == pytest.approx(2 / 3)
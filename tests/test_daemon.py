@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+from krill.daemon import DaemonRunning, QueryServer, error_response, query
+from krill.store import ItemStore
+
+pytest_plugins = ("pytest_asyncio",)
+
+
+def record(title, link):
+    return {"source": "test", "time": None, "title": title, "text": None, "link": link}
+
+
+@pytest.fixture
+def store():
+    store = ItemStore()
+    store.add("a", record("Python news", "http://example.com/python"))
+    store.add("b", record("Rust news", "http://example.com/rust"))
+    store.add("c", record("Weather", "http://example.com/weather"))
+    return store
+
+
+class TestQuery:
+    def test_all_items(self, store):
+        lines = QueryServer(store, "unused").query({})
+        assert len(lines) == 3
+
+    def test_filters(self, store):
+        lines = QueryServer(store, "unused").query({"filters": ["python", "rust"]})
+        assert sorted(json.loads(line)["title"] for line in lines) == [
+            "Python news",
+            "Rust news",
+        ]
+
+    def test_filters_are_compiled_once(self, store):
+        server = QueryServer(store, "unused")
+        server.query({"filters": ["python"]})
+        compiled = server._filters["python"]
+        server.query({"filters": ["python"]})
+        assert server._filters["python"] is compiled
+
+    def test_limit(self, store):
+        assert len(QueryServer(store, "unused").query({"limit": 2})) == 2
+
+    def test_invalid_request(self, store):
+        with pytest.raises(ValueError):
+            QueryServer(store, "unused").query(["python"])
+
+
+@pytest.mark.asyncio
+class TestQueryServer:
+    async def test_round_trip(self, store, tmp_path):
+        path = str(tmp_path / "krill.sock")
+        server = await QueryServer(store, path).start()
+        try:
+            response = await query(path, {"filters": ["weather"]})
+            assert [json.loads(line)["title"] for line in response.splitlines()] == [
+                "Weather"
+            ]
+            assert error_response(response) is None
+
+            response = await query(path, {"filters": ["("]})
+            assert error_response(response)
+        finally:
+            await server.close()
+
+    async def test_replaces_stale_socket(self, store, tmp_path):
+        path = str(tmp_path / "krill.sock")
+        first = await QueryServer(store, path).start()
+        # Simulate a daemon that exited without removing its socket
+        first._server.close()
+        await first._server.wait_closed()
+
+        second = await QueryServer(store, path).start()
+        try:
+            assert len((await query(path, {})).splitlines()) == 3
+        finally:
+            await second.close()
+
+    async def test_refuses_socket_of_running_daemon(self, store, tmp_path):
+        path = str(tmp_path / "krill.sock")
+        first = await QueryServer(store, path).start()
+        try:
+            with pytest.raises(DaemonRunning):
+                await QueryServer(store, path).start()
+
+            assert len((await query(path, {})).splitlines()) == 3
+        finally:
+            await first.close()
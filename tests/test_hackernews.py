@@ -0,0 +1,247 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from krill.client import ClientPool
+from krill.hackernews import HN_API_URL, HackerNewsSource, ItemCache
+from tests.hn_server import FakeHackerNews
+
+pytest_plugins = ("pytest_asyncio",)
+
+
+def _story(story_id):
+    return {
+        "id": story_id,
+        "by": "pg",
+        "time": int(time.time()),
+        "title": f"Story {story_id}",
+        "url": f"http://example.com/{story_id}",
+        "type": "story",
+    }
+
+
+class FakeClients:
+    def __init__(self, story_ids, delay=0):
+        self.story_ids = story_ids
+        self.delay = delay
+        self.requests = []
+        self.in_flight = 0
+        self.peak = 0
+
+    async def get(self, url, **kwargs):
+        self.requests.append(url)
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+
+        path = url[len(HN_API_URL) + 1 :]
+        if path in ("topstories.json", "newstories.json"):
+            payload = self.story_ids
+        else:
+            payload = _story(int(path.split("/")[1].split(".")[0]))
+        return httpx.Response(200, json=payload, request=httpx.Request("GET", url))
+
+
+async def _stories(source):
+    return [item async for item in source.stories()]
+
+
+@pytest.mark.asyncio
+class TestHackerNewsSource:
+    async def test_configured_number_of_stories(self):
+        clients = FakeClients(list(range(1, 51)))
+        items = await _stories(HackerNewsSource(clients, stories=20))
+
+        assert len(items) == 20
+        assert {item.source for item in items} == {"pg"}
+
+    async def test_bounded_concurrency(self):
+        clients = FakeClients(list(range(1, 51)), delay=0.01)
+        await _stories(HackerNewsSource(clients, stories=50, concurrency=5))
+
+        assert clients.peak == 5
+
+    async def test_cached_items_not_refetched(self):
+        clients = FakeClients([1, 2, 3])
+        source = HackerNewsSource(clients, stories=3)
+        await _stories(source)
+        await _stories(source)
+
+        item_requests = [url for url in clients.requests if "/item/" in url]
+        assert len(item_requests) == 3
+
+
+class TestItemCache:
+    def test_expiry(self):
+        cache = ItemCache(ttl=0)
+        cache.put(1, _story(1))
+        assert cache.get(1) is None
+
+    def test_survives_restart(self, tmp_path):
+        path = str(tmp_path / "hn_items.json")
+        cache = ItemCache(path)
+        cache.put(1, _story(1))
+        cache.save()
+
+        assert ItemCache(path).load().get(1)["title"] == "Story 1"
+
+    def test_written_only_when_changed(self, tmp_path):
+        path = tmp_path / "hn_items.json"
+        ItemCache(str(path)).load().save()
+        assert not path.exists()
+
+        cache = ItemCache(str(path)).load()
+        cache.put(1, _story(1))
+        cache.save()
+        path.write_text("{}")
+        cache.save()
+        assert path.read_text() == "{}"
+
+    @pytest.mark.parametrize("content", ["[1, 2]", '{"1": 5}', '{"x": [1, {}]}', "7"])
+    def test_malformed_file_ignored(self, tmp_path, content):
+        path = tmp_path / "hn_items.json"
+        path.write_text(content)
+
+        assert ItemCache(str(path)).load().get(1) is None
+
+
+@pytest.fixture
+def fake_hn():
+    with FakeHackerNews() as api:
+        yield api
+
+
+@pytest.mark.asyncio
+class TestIncremental:
+    async def test_only_new_items_fetched(self, fake_hn):
+        for _ in range(10):
+            fake_hn.add_story()
+
+        pool = ClientPool()
+        source = HackerNewsSource(
+            pool, stories=3, base_url=fake_hn.url, incremental=True
+        )
+        try:
+            # The first poll samples the story lists and sets the cursor
+            assert len(await _stories(source)) == 3
+            assert source.cursor == 10
+
+            new_story = fake_hn.add_story(title="Fresh")
+            fake_hn.add_comment(parent=new_story)
+            fake_hn.requests.clear()
+
+            items = await _stories(source)
+        finally:
+            await pool.aclose()
+
+        assert [item.title for item in items] == ["Fresh"]
+        assert source.cursor == 12
+        assert sorted(fake_hn.requests) == [
+            "/v0/item/11.json",
+            "/v0/item/12.json",
+            "/v0/maxitem.json",
+        ]
+
+    async def test_capped_cycles_pick_up_where_they_stopped(self, fake_hn):
+        for _ in range(5):
+            fake_hn.add_story()
+
+        pool = ClientPool()
+        source = HackerNewsSource(
+            pool, stories=2, concurrency=2, base_url=fake_hn.url, incremental=True
+        )
+        try:
+            await _stories(source)
+            for _ in range(6):
+                fake_hn.add_story()
+            cycles = []
+            requested = []
+            for _ in range(4):
+                fake_hn.requests.clear()
+                cycles.append(await _stories(source))
+                requested.append(
+                    {path for path in fake_hn.requests if "/item/" in path}
+                )
+        finally:
+            await pool.aclose()
+
+        assert [[item.link for item in items] for items in cycles] == [
+            ["http://example.com/6", "http://example.com/7"],
+            ["http://example.com/8", "http://example.com/9"],
+            ["http://example.com/10", "http://example.com/11"],
+            [],
+        ]
+        assert source.cursor == 11
+        # Stopping early leaves at most the fetches already in flight
+        assert requested[0] <= {f"/v0/item/{item_id}.json" for item_id in (6, 7, 8)}
+
+    async def test_failed_maxitem_keeps_cursor(self, fake_hn):
+        for _ in range(5):
+            fake_hn.add_story()
+
+        pool = ClientPool()
+        source = HackerNewsSource(
+            pool, stories=5, base_url=fake_hn.url, incremental=True
+        )
+        try:
+            await _stories(source)
+            fake_hn.add_story()
+            fake_hn.failing.add("/v0/maxitem.json")
+            assert await _stories(source) == []
+            assert source.cursor == 5
+
+            fake_hn.add_story()
+            items = await _stories(source)
+        finally:
+            await pool.aclose()
+
+        assert [item.link for item in items] == [
+            "http://example.com/6",
+            "http://example.com/7",
+        ]
+
+    async def test_failed_item_is_fetched_again(self, fake_hn):
+        for _ in range(3):
+            fake_hn.add_story()
+
+        pool = ClientPool()
+        source = HackerNewsSource(pool, base_url=fake_hn.url, incremental=True)
+        try:
+            await _stories(source)
+            for _ in range(3):
+                fake_hn.add_story()
+            fake_hn.failing.add("/v0/item/5.json")
+            first = await _stories(source)
+            assert source.cursor == 4
+
+            second = await _stories(source)
+        finally:
+            await pool.aclose()
+
+        assert [item.link for item in first] == ["http://example.com/4"]
+        assert [item.link for item in second] == [
+            "http://example.com/5",
+            "http://example.com/6",
+        ]
+
+    async def test_cursor_survives_restart(self, fake_hn, tmp_path):
+        fake_hn.add_story()
+        path = str(tmp_path / "hn_cursor.json")
+
+        pool = ClientPool()
+        try:
+            source = HackerNewsSource(
+                pool, base_url=fake_hn.url, incremental=True, cursor_path=path
+            )
+            await _stories(source)
+            source.save()
+        finally:
+            await pool.aclose()
+
+        restarted = HackerNewsSource(None, incremental=True, cursor_path=path).load()
+        assert restarted.cursor == 1
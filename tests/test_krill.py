@@ -1,10 +1,19 @@
+import asyncio
 import builtins
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 from unittest import mock
 
+import httpx
 import pytest
 
-from krill.feed.parser import fix_html
+from krill.feed.parser import LazyStreamItem, fix_html
 from krill.krill import Application
+from krill.scheduler import DomainLimit
+from krill.sources.parser import compile_filter
 
 pytest_plugins = ("pytest_asyncio",)
 
@@ -59,6 +68,17 @@ class TestFixLinks:
         assert expected == actual
 
 
+class TestDecorations:
+    def test_whole_text_is_searched(self):
+        text = "Read python.org/#python or #python now"
+        decorations = Application._decorations(text)
+
+        assert [text[start:end] for start, end, _ in decorations] == [
+            "python.org/#python",
+            "#python",
+        ]
+
+
 @pytest.mark.asyncio
 class TestReadSourceFile:
     @pytest.fixture(autouse=True)
@@ -97,3 +117,274 @@ class TestReadSourceFile:
             "http://www.nytimes.com/services/xml/rss/nyt/HomePage.xml": "bailout",
         }
         assert expected == actual
+
+
+RSS_FEED = """<?xml version="1.0"?>
+<rss version="2.0"><channel><title>Test</title>
+<item>
+  <title>Python news</title>
+  <link>http://example.com/python</link>
+  <description>All about python</description>
+  <pubDate>{date}</pubDate>
+</item>
+</channel></rss>
+"""
+
+
+@pytest.mark.asyncio
+class TestUpdate:
+    @pytest.fixture(autouse=True)
+    def setUp(self):
+        self.args = mock.MagicMock()
+        self.args.text_speed_ave = "0"
+        self.args.snapshot = True
+        self.args.verbose = False
+        self.args.domain_limit = None
+        self.args.stats_json = None
+        self.args.stats_prometheus = None
+        self.application = Application(self.args)
+        self.application.sources = [("http://example.com/rss", [])]
+
+        date = datetime.now(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S %z")
+        url = "http://example.com/rss"
+        self.application.clients.get = mock.AsyncMock(
+            return_value=httpx.Response(
+                200,
+                content=RSS_FEED.format(date=date).encode(),
+                request=httpx.Request("GET", url),
+            )
+        )
+
+    async def test_update_finishes_when_pipeline_drains(self, capsys):
+        start = time.monotonic()
+        await asyncio.wait_for(self.application.update(), timeout=5)
+
+        assert time.monotonic() - start < 1
+        assert "Python news" in capsys.readouterr().out
+
+    async def test_rejected_items_are_dropped_early(self):
+        reject = compile_filter("golang")
+        self.application.sources = [("http://example.com/rss", [reject])]
+        await asyncio.wait_for(self.application.update(), timeout=5)
+        metrics = self.application.metrics
+        assert metrics.counter("items", stage="rejected") == 1
+
+        await asyncio.wait_for(self.application.update(), timeout=5)
+        assert metrics.counter("items", stage="rejected") == 1
+        assert metrics.counter("items", stage="known") == 1
+
+    async def test_first_matching_filter_wins(self, capsys):
+        python, news = compile_filter("python"), compile_filter("news")
+        self.application.sources = [("http://example.com/rss", [python, news])]
+        await asyncio.wait_for(self.application.update(), timeout=5)
+
+        metrics = self.application.metrics
+        assert metrics.counter("filter_checks", filter="") == 1
+        assert metrics.counter("filter_hits", filter="") == 1
+        assert "Python news" in capsys.readouterr().out
+
+    async def test_broken_item_does_not_drop_its_feed(self):
+        def html_to_text(html):
+            if "broken" in html:
+                raise ValueError("broken markup")
+            return html
+
+        items = [
+            LazyStreamItem("a", None, "Python one", "broken", "http://a/1"),
+            LazyStreamItem("a", None, "Python two", "fine", "http://a/2"),
+        ]
+        self.application.add_item = mock.AsyncMock()
+        queue = asyncio.Queue()
+        queue.put_nowait((items, [compile_filter("python")]))
+        with mock.patch("krill.feed.parser.html_to_text", html_to_text):
+            task = asyncio.create_task(self.application.stream_worker(queue))
+            await asyncio.wait_for(queue.join(), timeout=5)
+            task.cancel()
+
+        self.application.add_item.assert_called_once()
+        assert self.application.add_item.call_args.args[0] is items[1]
+
+    async def test_filters_split_across_workers(self):
+        filter_strings = ["rust", "news", "python", "go"]
+        re_funcs = [compile_filter(f) for f in filter_strings]
+        self.application._filter_labels = dict(zip(re_funcs, filter_strings))
+        items = [
+            ("Python news", "All about python", "http://a"),
+            ("Go", None, "http://b"),
+            ("Java", "", "http://c"),
+        ]
+        expected = await self.application._filter_batch(items, re_funcs)
+
+        self.args.filter_workers = 3
+        self.application._filter_pool = ThreadPoolExecutor(3)
+        try:
+            with mock.patch("krill.krill.FILTER_SHARD_SIZE", 1):
+                assert self.application._filter_shards(re_funcs) == [
+                    ["rust", "news"],
+                    ["python", "go"],
+                ]
+                actual = await self.application._filter_batch(items, re_funcs)
+        finally:
+            self.application._filter_pool.shutdown()
+
+        assert actual == expected
+        assert actual[0]["title"] == {(7, 11)}
+        assert set(actual) == {0, 1}
+
+    async def test_cli_domain_limit_beats_built_in(self):
+        self.args.domain_limit = {"old.reddit.com": DomainLimit(concurrency=3)}
+
+        assert self.application._scheduler("old.reddit.com").limit == DomainLimit(3)
+        assert self.application._scheduler("www.reddit.com").limit.concurrency == 1
+
+    async def test_validators_dropped_when_filters_change(self):
+        response = self.application.clients.get.return_value
+        response.headers["ETag"] = '"abc"'
+        python, rust = compile_filter("python"), compile_filter("rust")
+        self.application._filter_labels = {python: "python", rust: "rust"}
+
+        def sent_headers():
+            return self.application.clients.get.call_args.kwargs["headers"]
+
+        self.application.sources = [("http://example.com/rss", [python])]
+        await asyncio.wait_for(self.application.update(), timeout=5)
+        await asyncio.wait_for(self.application.update(), timeout=5)
+        assert sent_headers()["If-None-Match"] == '"abc"'
+
+        self.application.sources = [("http://example.com/rss", [rust])]
+        await asyncio.wait_for(self.application.update(), timeout=5)
+        assert "If-None-Match" not in sent_headers()
+
+    async def test_update_selected_sources(self):
+        await asyncio.wait_for(self.application.update(sources=[]), timeout=5)
+
+        self.application.clients.get.assert_not_called()
+
+    async def test_update_writes_stats(self, tmp_path):
+        self.args.stats_json = str(tmp_path / "stats.json")
+        self.args.stats_prometheus = str(tmp_path / "stats.prom")
+        await asyncio.wait_for(self.application.update(), timeout=5)
+
+        metrics = self.application.metrics
+        assert metrics.counter("items", stage="parsed") == 1
+        assert metrics.counter("items", stage="accepted") == 1
+        assert metrics.summary("request_seconds", domain="example.com").count == 1
+        assert json.loads((tmp_path / "stats.json").read_text())["counters"]
+        assert (
+            'krill_items_total{stage="parsed"} 1'
+            in (tmp_path / "stats.prom").read_text()
+        )
+
+
+@pytest.mark.asyncio
+class TestReload:
+    @pytest.fixture(autouse=True)
+    def setUp(self, tmp_path):
+        self.sources_file = tmp_path / "sources.txt"
+        self.filters_file = tmp_path / "filters.txt"
+        self.sources_file.write_text("http://example.com/rss\n")
+        self.filters_file.write_text("python\nrust\n")
+
+        self.args = mock.MagicMock()
+        self.args.sources = None
+        self.args.sources_file = str(self.sources_file)
+        self.args.filters = None
+        self.args.filters_file = str(self.filters_file)
+        self.application = Application(self.args)
+
+    async def test_only_new_sources_are_returned(self):
+        assert await self.application.populate_sources() == ["http://example.com/rss"]
+
+        self.sources_file.write_text(
+            "http://example.com/rss\nhttp://example.org/atom\n"
+        )
+        assert await self.application.populate_sources() == ["http://example.org/atom"]
+        assert [source for source, _ in self.application.sources] == [
+            "http://example.com/rss",
+            "http://example.org/atom",
+        ]
+
+    async def test_mention_filter_is_not_an_option(self):
+        self.sources_file.write_text("https://x.com/nasa @NASA\n")
+        await self.application.populate_sources()
+
+        _, re_funcs = self.application.sources[0]
+        assert list(self.application._compiled_filters) == ["@NASA"]
+        assert re_funcs[0]("Launch news from @NASA")[0]
+
+    async def test_unchanged_filters_are_not_recompiled(self):
+        await self.application.populate_sources()
+        python_filter = self.application._compiled_filters["python"]
+
+        self.filters_file.write_text("python\ngo\n")
+        await self.application.populate_sources()
+
+        assert self.application._compiled_filters["python"] is python_filter
+        assert set(self.application._compiled_filters) == {"python", "go"}
+        _, re_funcs = self.application.sources[0]
+        assert re_funcs[0] is python_filter
+
+    async def test_reload_worker_fetches_added_sources(self):
+        self.application._mtimes = self.application._file_mtimes()
+        await self.application.populate_sources()
+        self.application.update = mock.AsyncMock()
+
+        self.sources_file.write_text(
+            "http://example.com/rss\nhttp://example.org/atom\n"
+        )
+        os.utime(self.sources_file, ns=(0, 0))
+        task = asyncio.create_task(self.application.reload_worker(interval=0.01))
+        try:
+            for _ in range(100):
+                if self.application.update.called:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            task.cancel()
+
+        self.application.update.assert_called_once_with(["http://example.org/atom"])
+
+    async def test_broken_filter_keeps_previous_configuration(self):
+        self.application._mtimes = self.application._file_mtimes()
+        await self.application.populate_sources()
+        sources = self.application.sources
+
+        self.filters_file.write_text("(\n")
+        os.utime(self.filters_file, ns=(0, 0))
+        task = asyncio.create_task(self.application.reload_worker(interval=0.01))
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+        assert self.application.sources is sources
+
+    async def test_reload_waits_for_running_cycle(self):
+        self.application._mtimes = self.application._file_mtimes()
+        await self.application.populate_sources()
+        sources = self.application.sources
+
+        self.filters_file.write_text("go\n")
+        os.utime(self.filters_file, ns=(0, 0))
+        async with self.application._update_lock:
+            task = asyncio.create_task(self.application.reload_worker(interval=0.01))
+            await asyncio.sleep(0.05)
+            assert self.application.sources is sources
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+        assert self.application.sources is not sources
+
+    async def test_reload_worker_survives_errors(self):
+        self.application._mtimes = self.application._file_mtimes()
+        self.application.populate_sources = mock.AsyncMock(
+            side_effect=[OSError("gone"), []]
+        )
+
+        os.utime(self.filters_file, ns=(0, 0))
+        task = asyncio.create_task(self.application.reload_worker(interval=0.01))
+        await asyncio.sleep(0.05)
+        os.utime(self.filters_file, ns=(10**9, 10**9))
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+        assert self.application.populate_sources.call_count == 2
+        assert self.application.metrics.counter("reloads") == 1
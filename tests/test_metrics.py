@@ -0,0 +1,60 @@
+import json
+
+from krill.metrics import Metrics
+
+
+class TestMetrics:
+    def test_counters_are_keyed_by_labels(self):
+        metrics = Metrics()
+        metrics.inc("items", stage="parsed")
+        metrics.inc("items", 2, stage="parsed")
+        metrics.inc("items", stage="duplicate")
+
+        assert metrics.counter("items", stage="parsed") == 3
+        assert metrics.counter("items", stage="duplicate") == 1
+        assert metrics.counter("items", stage="flushed") == 0
+
+    def test_summary(self):
+        metrics = Metrics()
+        metrics.observe("request_seconds", 0.5, domain="example.com")
+        metrics.observe("request_seconds", 1.5, domain="example.com")
+
+        summary = metrics.summary("request_seconds", domain="example.com")
+        assert (summary.count, summary.sum, summary.max) == (2, 2.0, 1.5)
+
+    def test_timer(self):
+        metrics = Metrics()
+        with metrics.timer("flush_seconds"):
+            pass
+
+        assert metrics.summary("flush_seconds").count == 1
+
+    def test_prometheus(self):
+        metrics = Metrics()
+        metrics.inc("items", stage="parsed")
+        metrics.inc("items", stage="rendered")
+        metrics.set("http_connection_reuse_ratio", 0.5)
+        metrics.observe("request_seconds", 0.25, domain='a"b')
+
+        assert metrics.prometheus().splitlines() == [
+            "# TYPE krill_items_total counter",
+            'krill_items_total{stage="parsed"} 1',
+            'krill_items_total{stage="rendered"} 1',
+            "# TYPE krill_http_connection_reuse_ratio gauge",
+            "krill_http_connection_reuse_ratio 0.5",
+            "# TYPE krill_request_seconds summary",
+            'krill_request_seconds_count{domain="a\\"b"} 1',
+            'krill_request_seconds_sum{domain="a\\"b"} 0.25',
+            "# TYPE krill_request_seconds_max gauge",
+            'krill_request_seconds_max{domain="a\\"b"} 0.25',
+        ]
+
+    def test_write(self, tmp_path):
+        metrics = Metrics()
+        metrics.inc("items", stage="parsed")
+        metrics.write(tmp_path / "stats.json", tmp_path / "stats.prom")
+
+        assert json.loads((tmp_path / "stats.json").read_text())["counters"] == [
+            {"name": "items", "labels": {"stage": "parsed"}, "value": 1}
+        ]
+        assert (tmp_path / "stats.prom").read_text().startswith("# TYPE")
@@ -0,0 +1,139 @@
+import asyncio
+import io
+import json
+from datetime import datetime, timezone
+from unittest import mock
+
+import pytest
+
+from krill.feed.parser import StreamItem
+from krill.output import (
+    NDJSONWriter,
+    TerminalRenderer,
+    ansi_runs,
+    drain,
+    highlight,
+    merge_spans,
+    snapshot_record,
+)
+
+pytest_plugins = ("pytest_asyncio",)
+
+BOLD = "\x1b[1m"
+RESET = "\x1b(B\x1b[m"
+
+
+class TestAnsiRuns:
+    def test_plain(self):
+        assert ansi_runs("python") == [(False, "python")]
+
+    def test_codes(self):
+        assert ansi_runs(f"a {BOLD}python{RESET}!") == [
+            (False, "a "),
+            (True, BOLD),
+            (False, "python"),
+            (True, "\x1b(B"),
+            (True, "\x1b[m"),
+            (False, "!"),
+        ]
+
+
+class TestHighlight:
+    def test_merge_spans(self):
+        assert merge_spans({(5, 8), (0, 2), (1, 3), (9, 9)}) == [(0, 3), (5, 8)]
+        assert merge_spans(None) == []
+
+    def test_highlight(self):
+        mark = "[{}]".format
+        assert highlight("python is fun", [(0, 6), (10, 13)], mark) == (
+            "[python] is [fun]"
+        )
+
+    def test_text_style(self):
+        mark = "[{}]".format
+        bold = "*{}*".format
+        assert highlight("a b c", [(2, 3)], mark, bold) == "*a *[b]* c*"
+        assert highlight("a b c", [], mark, bold) == "*a b c*"
+
+    def test_decorations_around_spans(self):
+        mark = "[{}]".format
+        link = "<{}>".format
+        text = "see example.com/python now"
+        assert highlight(text, [(16, 22)], mark, decorations=[(4, 22, link)]) == (
+            "see <example.com/>[python] now"
+        )
+        assert highlight(text, [(4, 11)], mark, decorations=[(4, 22, link)]) == (
+            "see [example]<.com/python> now"
+        )
+        assert highlight("ab ab", [(0, 2)], mark, decorations=[(3, 5, link)]) == (
+            "[ab] <ab>"
+        )
+
+
+@pytest.mark.asyncio
+class TestTerminalRenderer:
+    async def test_batch_single_write(self):
+        stream = io.StringIO()
+        stream.write = mock.Mock(wraps=stream.write)
+        await TerminalRenderer(stream).write(["one", f"{BOLD}two{RESET}"])
+
+        stream.write.assert_called_once_with(f"one\n{BOLD}two{RESET}\n")
+
+    async def test_typewriter(self):
+        stream = io.StringIO()
+        delays = []
+
+        def delay():
+            delays.append(0)
+            return 0
+
+        await TerminalRenderer(stream, delay).write([f"{BOLD}ab{RESET}"])
+
+        assert stream.getvalue() == f"{BOLD}ab{RESET}\n"
+        # Pauses only between visible characters
+        assert len(delays) == 2
+
+    async def test_drain(self):
+        queue = asyncio.Queue()
+        for item in ("b", "c"):
+            queue.put_nowait(item)
+
+        assert drain(queue, "a") == ["a", "b", "c"]
+        assert drain(queue, "d") == ["d"]
+
+
+class TestNDJSONWriter:
+    def test_record(self):
+        item = StreamItem(
+            "example.com",
+            datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+            "Python news",
+            "All about python",
+            "http://example.com/python",
+            "urn:example:python",
+        )
+        assert snapshot_record(item) == {
+            "source": "example.com",
+            "time": "2024-01-02T03:04:05+00:00",
+            "title": "Python news",
+            "text": "All about python",
+            "link": "http://example.com/python",
+            "guid": "urn:example:python",
+        }
+
+    def test_buffered(self):
+        stream = io.StringIO()
+        writer = NDJSONWriter(stream, buffer_size=1024)
+        writer.write({"title": "a"})
+        writer.write({"title": "b"})
+        assert stream.getvalue() == ""
+
+        writer.flush()
+        lines = stream.getvalue().splitlines()
+        assert [json.loads(line) for line in lines] == [{"title": "a"}, {"title": "b"}]
+
+    def test_flushes_when_full(self):
+        stream = io.StringIO()
+        writer = NDJSONWriter(stream, buffer_size=10)
+        writer.write({"title": "python"})
+        assert stream.getvalue() == '{"title": "python"}\n'
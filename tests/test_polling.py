@@ -0,0 +1,132 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from krill.polling import (
+    POLL_MAX_INTERVAL,
+    POLL_MIN_INTERVAL,
+    PollingScheduler,
+    cache_lifetime,
+    feed_hints,
+    split_source_options,
+)
+
+NOW = datetime(2024, 1, 1, 12, 30, tzinfo=timezone.utc).timestamp()
+
+FEED = b"""<?xml version="1.0"?>
+<rss version="2.0"><channel><title>Test</title>
+<ttl>60</ttl>
+<skipHours><hour>13</hour><hour>14</hour></skipHours>
+<skipDays><day>Saturday</day><day>Sunday</day></skipDays>
+</channel></rss>
+"""
+
+
+def posted_every(minutes, count=10):
+    start = datetime.fromtimestamp(NOW, timezone.utc)
+    return [start - timedelta(minutes=minutes * i) for i in range(count)]
+
+
+class TestSplitSourceOptions:
+    def test_options_and_patterns(self):
+        assert split_source_options("@interval=600 @max=3600 python") == (
+            {"interval": 600, "max": 3600},
+            "python",
+        )
+
+    def test_no_options(self):
+        assert split_source_options("python or rust") == ({}, "python or rust")
+        assert split_source_options([]) == ({}, "")
+
+    def test_mention_filters(self):
+        assert split_source_options("@NASA") == ({}, "@NASA")
+        assert split_source_options("@interval=60 @speed=1 @interval") == (
+            {"interval": 60},
+            "@speed=1 @interval",
+        )
+
+    @pytest.mark.parametrize("patterns", ["@interval=abc", "@min=-5", "@max=0"])
+    def test_invalid(self, patterns):
+        with pytest.raises(ValueError):
+            split_source_options(patterns)
+
+
+class TestHints:
+    def test_feed_hints(self):
+        assert feed_hints(FEED) == {
+            "ttl": 3600,
+            "skip_hours": {13, 14},
+            "skip_days": {5, 6},
+        }
+
+    def test_cache_control(self):
+        assert cache_lifetime({"Cache-Control": "public, max-age=900"}) == 900
+        assert cache_lifetime({"Cache-Control": "no-cache"}) == 0
+
+    def test_expires(self):
+        headers = {
+            "Date": "Mon, 01 Jan 2024 12:00:00 GMT",
+            "Expires": "Mon, 01 Jan 2024 12:30:00 GMT",
+        }
+        assert cache_lifetime(headers) == 1800
+        assert cache_lifetime({"Expires": "0"}) == 0
+
+
+class TestPollingScheduler:
+    @pytest.fixture(autouse=True)
+    def setUp(self):
+        self.polling = PollingScheduler(300, jitter=0)
+        self.polling.add("feed", now=NOW)
+
+    def test_default_interval(self):
+        assert self.polling.interval("feed") == 300
+
+    def test_learns_posting_rate(self):
+        self.polling.record_items("feed", posted_every(60))
+        assert self.polling.interval("feed") == 30 * 60
+
+    def test_interval_is_clamped(self):
+        self.polling.record_items("feed", posted_every(1))
+        assert self.polling.interval("feed") == POLL_MIN_INTERVAL
+
+        self.polling.add("other", now=NOW)
+        self.polling.record_items("other", posted_every(60 * 24 * 7))
+        assert self.polling.interval("other") == POLL_MAX_INTERVAL
+
+    def test_server_hints_are_a_lower_bound(self):
+        self.polling.record_items("feed", posted_every(5))
+        self.polling.record_response("feed", {"Cache-Control": "max-age=900"})
+        assert self.polling.interval("feed") == 900
+
+        self.polling.record_response("feed", {}, FEED)
+        assert self.polling.interval("feed") == 3600
+
+    def test_override(self):
+        self.polling.add("feed", {"interval": 42})
+        self.polling.record_response("feed", {}, FEED)
+        assert self.polling.interval("feed") == 42
+
+    def test_due(self):
+        assert self.polling.due(NOW) == ["feed"]
+
+        assert self.polling.schedule("feed", NOW) == NOW + 300
+        assert self.polling.next_due() == NOW + 300
+        assert self.polling.due(NOW) == []
+        assert self.polling.due(NOW + 300) == ["feed"]
+
+    def test_skips_idle_hours_and_days(self):
+        self.polling.add("feed", {"interval": 3600})
+        self.polling.record_response("feed", {}, FEED)
+
+        # Monday 13:30 and 14:30 are skipped
+        due = self.polling.schedule("feed", NOW)
+        assert datetime.fromtimestamp(due, timezone.utc) == datetime(
+            2024, 1, 1, 15, tzinfo=timezone.utc
+        )
+
+        # Friday evening moves on to Monday
+        friday = datetime(2024, 1, 5, 23, 30, tzinfo=timezone.utc).timestamp()
+        due = self.polling.schedule("feed", friday)
+        assert datetime.fromtimestamp(due, timezone.utc) == datetime(
+            2024, 1, 8, 0, tzinfo=timezone.utc
+        )
@@ -0,0 +1,40 @@
+import io
+import pstats
+
+from krill.profiling import CycleProfiler
+
+
+def busy():
+    return sum(i * i for i in range(1000))
+
+
+class TestCycleProfiler:
+    def test_disabled(self, tmp_path):
+        profiler = CycleProfiler()
+        with profiler.cycle():
+            busy()
+
+        assert profiler.cycle_number == 0
+
+    def test_writes_one_file_per_cycle(self, tmp_path):
+        profiler = CycleProfiler(str(tmp_path))
+        for _ in range(2):
+            with profiler.cycle():
+                busy()
+
+        assert sorted(path.name for path in tmp_path.iterdir()) == [
+            "cycle-0001.pstats",
+            "cycle-0002.pstats",
+        ]
+        stats = pstats.Stats(profiler.path(1))
+        assert any(func[2] == "busy" for func in stats.stats)
+
+    def test_prints_top_functions(self):
+        stream = io.StringIO()
+        profiler = CycleProfiler(top=5, stream=stream)
+        with profiler.cycle():
+            busy()
+
+        output = stream.getvalue()
+        assert output.startswith("Profile of update cycle 1:")
+        assert "busy" in output
@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+import pytest
+
+from krill.scheduler import (
+    DEFAULT_LIMIT,
+    DOMAIN_LIMITS,
+    DomainLimit,
+    DomainScheduler,
+    TokenBucket,
+    limit_for,
+    parse_domain_limit,
+)
+
+pytest_plugins = ("pytest_asyncio",)
+
+
+class TestLimitFor:
+    def test_override(self):
+        limits = {"reddit": DomainLimit(concurrency=1)}
+        assert limit_for("www.Reddit.com", limits) == DomainLimit(concurrency=1)
+
+    def test_default(self):
+        assert limit_for("rss.slashdot.org", {}) == DEFAULT_LIMIT
+
+    def test_most_specific_key_wins(self):
+        limits = {**DOMAIN_LIMITS, "old.reddit.com": DomainLimit(concurrency=3)}
+        assert limit_for("old.reddit.com", limits) == DomainLimit(concurrency=3)
+        assert limit_for("www.reddit.com", limits) == DOMAIN_LIMITS["reddit"]
+
+
+class TestParseDomainLimit:
+    def test_concurrency_only(self):
+        assert parse_domain_limit("reddit=2") == ("reddit", DomainLimit(2))
+
+    def test_concurrency_and_rate(self):
+        assert parse_domain_limit("reddit=1/0.5") == (
+            "reddit",
+            DomainLimit(concurrency=1, rate=0.5),
+        )
+
+    @pytest.mark.parametrize("spec", ["reddit", "=1", "reddit=0", "reddit=1/0"])
+    def test_invalid(self, spec):
+        with pytest.raises(ValueError):
+            parse_domain_limit(spec)
+
+
+@pytest.mark.asyncio
+class TestDomainScheduler:
+    async def test_token_bucket_spacing(self):
+        bucket = TokenBucket(rate=50)
+        start = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        # The first token is available immediately, the next two take 20ms each
+        assert time.monotonic() - start >= 0.035
+
+    async def test_concurrency(self):
+        scheduler = DomainScheduler(DomainLimit(concurrency=2))
+        running = 0
+        peak = 0
+
+        async def request():
+            nonlocal running, peak
+            async with scheduler:
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+        await asyncio.gather(*(request() for _ in range(5)))
+        assert peak == 2
@@ -0,0 +1,174 @@
+import json
+import sqlite3
+from unittest import mock
+
+from krill.store import BloomFilter, ItemStore, SeenStore
+
+
+class TestBloomFilter:
+    def test_membership(self):
+        bloom = BloomFilter(bits=1024, hashes=3)
+        bloom.add("http://example.com/a")
+
+        assert "http://example.com/a" in bloom
+        assert "http://example.com/b" not in bloom
+
+    def test_clear(self):
+        bloom = BloomFilter(bits=1024, hashes=3)
+        bloom.add("http://example.com/a")
+        bloom.clear()
+
+        assert "http://example.com/a" not in bloom
+
+
+class TestSeenStore:
+    def test_add(self):
+        store = SeenStore()
+        assert "a" not in store
+        store.add("a")
+        assert "a" in store
+
+    def test_survives_restart(self, tmp_path):
+        path = str(tmp_path / "seen.db")
+        store = SeenStore(path)
+        store.add("a")
+        store.close()
+
+        store = SeenStore(path)
+        assert "a" in store
+        assert "b" not in store
+
+    def test_evict_expired(self):
+        store = SeenStore(ttl=60)
+        with mock.patch("krill.store.time.time", return_value=1000):
+            store.add("old")
+        with mock.patch("krill.store.time.time", return_value=1050):
+            store.add("new")
+        with mock.patch("krill.store.time.time", return_value=1100):
+            assert store.evict() == 1
+
+        assert "old" not in store
+        assert "new" in store
+
+    def test_evict_least_recently_seen(self):
+        store = SeenStore(max_items=2)
+        for now, key in enumerate(("a", "b", "c")):
+            with mock.patch("krill.store.time.time", return_value=1000 + now):
+                store.add(key)
+        with mock.patch("krill.store.time.time", return_value=1010):
+            # Seeing "a" again makes "b" the oldest entry
+            assert "a" in store
+            assert store.evict() == 1
+
+        assert len(store) == 2
+        assert "b" not in store
+
+
+class TestSeenStoreBloom:
+    def test_answers_before_filter_is_built(self, tmp_path):
+        path = str(tmp_path / "seen.db")
+        store = SeenStore(path)
+        store.add("a")
+        store.close()
+
+        store = SeenStore(path)
+        assert store.needs_rebuild
+        assert "a" in store
+        assert "b" not in store
+
+        store.rebuild_bloom()
+        assert not store.needs_rebuild
+        assert "a" in store
+
+    def test_keeps_uncommitted_keys(self, tmp_path):
+        store = SeenStore(str(tmp_path / "seen.db"))
+        store.add("a")
+        store.rebuild_bloom()
+
+        assert "a" in store
+
+    def test_rebuilt_after_enough_evictions(self):
+        store = SeenStore(ttl=float("inf"), max_items=8)
+        for now, key in enumerate("abcdefgh"):
+            with mock.patch("krill.store.time.time", return_value=1000 + now):
+                store.add(key)
+
+        store.max_items = 7
+        store.evict()
+        assert not store.needs_rebuild
+
+        store.max_items = 5
+        store.evict()
+        assert store.needs_rebuild
+
+    def test_refreshes_written_on_commit(self, tmp_path):
+        path = str(tmp_path / "seen.db")
+        store = SeenStore(path)
+        with mock.patch("krill.store.time.time", return_value=1000):
+            store.add("a")
+            store.commit()
+
+        def seen_at():
+            db = sqlite3.connect(path)
+            try:
+                return db.execute("SELECT seen_at FROM seen").fetchone()[0]
+            finally:
+                db.close()
+
+        with mock.patch("krill.store.time.time", return_value=2000):
+            assert "a" in store
+            assert seen_at() == 1000
+            store.commit()
+        assert seen_at() == 2000
+
+
+def record(title, link):
+    return {"source": "test", "time": None, "title": title, "text": None, "link": link}
+
+
+def test_seen_store_keys():
+    store = SeenStore()
+    for key in ("a.com\t1", "a.com\t2", "b.com\t1", "link:a.com/1"):
+        store.add(key)
+
+    assert store.keys("a.com\t") == {"a.com\t1", "a.com\t2"}
+    assert len(store.keys()) == 4
+
+
+class TestItemStore:
+    def test_items_newest_first(self):
+        store = ItemStore()
+        with mock.patch("krill.store.time.time", side_effect=[100, 200]):
+            store.add("a", record("First", "http://example.com/a"))
+            store.add("b", record("Second", "http://example.com/b"))
+
+        rows = list(store.items())
+        assert [row[0] for row in rows] == ["Second", "First"]
+        assert json.loads(rows[0][3]) == record("Second", "http://example.com/b")
+        assert [row[0] for row in store.items(since=150)] == ["Second"]
+
+    def test_add_replaces(self):
+        store = ItemStore()
+        store.add("a", record("First", "http://example.com/a"))
+        store.add("a", record("First", "http://example.com/a"))
+
+        assert len(store) == 1
+
+    def test_evict(self):
+        store = ItemStore(ttl=10, max_items=1)
+        with mock.patch("krill.store.time.time", side_effect=[100, 195, 196]):
+            store.add("a", record("Old", "http://example.com/a"))
+            store.add("b", record("New", "http://example.com/b"))
+            store.add("c", record("Newer", "http://example.com/c"))
+
+        with mock.patch("krill.store.time.time", return_value=200):
+            assert store.evict() == 2
+        assert [row[0] for row in store.items()] == ["Newer"]
+
+    def test_survives_restart(self, tmp_path):
+        path = str(tmp_path / "items.db")
+        store = ItemStore(path)
+        store.add("a", record("First", "http://example.com/a"))
+        store.close()
+
+        assert len(ItemStore(path)) == 1